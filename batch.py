@@ -0,0 +1,51 @@
+import sys
+import argparse
+import matplotlib
+matplotlib.use('Agg')   # no display on compute nodes
+from preprocessing.classes.batch import run_batch, read_manifest, folder_studies
+
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Cut studies without the GUI.')
+    parser.add_argument('folder', nargs='?', help='cut every PET/CT image in this folder')
+    parser.add_argument('--manifest', help='JSON list of studies: {"file", "cutter", "nmice", "cx", "cy", "rotations"}')
+    parser.add_argument('--out', required=True, help='directory for the cut images')
+    parser.add_argument('--cutter', choices=['cross','up_T','down_T','horizontal','vertical'], help='default cutter (detected if not given)')
+    parser.add_argument('--nmice', type=int, choices=[1,2,3,4], help='default number of mice (detected if not given)')
+    parser.add_argument('--cx', type=int, help='default x cut coordinate (placed automatically if not given)')
+    parser.add_argument('--cy', type=int, help='default y cut coordinate (placed automatically if not given)')
+    parser.add_argument('--rotate', action='append', choices=['x','y','z'], dest='rotations',
+                        help='default rotation axis; repeat to rotate several times')
+    parser.add_argument('--float', action='store_true',
+                        help='save through the scaled float data instead of copying the raw data')
+    parser.add_argument('--workers', type=int, default=1, help='number of studies to cut at once')
+    parser.add_argument('--memory-budget', type=int, dest='memory_budget',
+                        help='memory budget per worker in MB (bounds the read/write block size and, with --float, the buffers kept in RAM)')
+    parser.add_argument('--scratch', help='directory for temp memmaps with --float (e.g. local NVMe or tmpfs)')
+    args = parser.parse_args(argv)
+    if (args.folder is None) == (args.manifest is None):
+        parser.error('give exactly one of folder or --manifest')
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.manifest is not None:
+        studies = read_manifest(args.manifest)
+    else:
+        studies = folder_studies(args.folder)
+    defaults = {k:getattr(args,k) for k in ['cutter','nmice','cx','cy','rotations'] if getattr(args,k) is not None}
+    memory_budget = args.memory_budget*10**6 if args.memory_budget is not None else None
+    results = run_batch(studies, args.out, defaults=defaults, raw=not args.float,
+                        workers=args.workers, memory_budget=memory_budget, scratch_root=args.scratch)
+    failed = [f for f,r in results.items() if isinstance(r, Exception)]
+    print('Cut {0} of {1} studies.'.format(len(results)-len(failed), len(results)))
+    for f in failed:
+        print('Failed: {}'.format(f))
+    return 1 if failed else 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -4,23 +4,29 @@ if sys.platform == 'darwin':
     matplotlib.use('TkAgg')
 import ntpath
 import atexit
-import gc
 import tkinter as tk
-import tempfile
-import shutil
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tkinter import Tk
 from collections import defaultdict                
 from tkinter import font  as tkfont 
 from tkinter.filedialog import askopenfilename, askdirectory
 from preprocessing.classes.baseimage import *
 from preprocessing.classes.imageviewer import *
+from preprocessing.classes.headerindex import HeaderIndex
+from preprocessing.classes.batch import NMICE_CUTTERS
+from preprocessing.classes.prefetch import Prefetcher
+from preprocessing.classes.scratch import ScratchManager
+from preprocessing.classes.storage import StoragePolicy
 
-TEMPLOG = 'templog.txt'
+HEADER_INDEX = 'header_index.json'  # kept in the data folder unless given
 
 
 
 class LoadScreen(tk.Toplevel):
-    def __init__(self, parent, text):
+    def __init__(self, parent, text, cancel=None):
         tk.Toplevel.__init__(self, parent)
         w = 500 # width for the Tk root
         h = 250 # height for the Tk root
@@ -40,16 +46,31 @@ class LoadScreen(tk.Toplevel):
         label = tk.Label(self, text=text, font=tkfont.Font(family='Helvetica', size=18, weight="bold", slant="italic"))
         label.pack(side="top", fill="x", pady=10)
 
+        # progress text, see set_progress
+        self.progress = tk.StringVar()
+        tk.Label(self, textvariable=self.progress, font=tkfont.Font(family='Helvetica', size=12)).pack(side="top", fill="x", pady=10)
+
+        if cancel is not None:
+            tk.Button(self, text="Cancel", command=cancel).pack(side="top", pady=10)
+            self.protocol("WM_DELETE_WINDOW", cancel)
+
         ## required to make window show before the program gets to the mainloop
         self.update()
 
+    def set_progress(self, done, total, elapsed):
+        text = 'Read {0:.0f} of {1:.0f} MB'.format(done/10**6, total/10**6)
+        if 0 < done < total:
+            text += ' ({:.0f} s left)'.format(elapsed*(total-done)/done)
+        self.progress.set(text)
+
 
 
 
 
 class ImageGUI(tk.Tk):
 
-    def __init__(self, folder='data'):
+    def __init__(self, folder='data', header_index=None, scan_workers=8, prefetch_budget=2*10**9,
+                 scratch_root=None, scratch_quota=None, ram_threshold=256*10**6):
         tk.Tk.__init__(self)
         self.title("Image Preprocessing")
         w = 500 # width for the Tk root
@@ -72,7 +93,23 @@ class ImageGUI(tk.Tk):
         self.image_editor = None
         self.nmice = None
         self.folder = folder.strip('/').strip('\\').strip()
-        self.tempdirs = []
+
+        # temp memmaps of loaded images; stale sessions of crashed runs are swept here
+        self.scratch = ScratchManager(root=scratch_root, quota=scratch_quota)
+
+        # loaded data, cuts and projections live in RAM up to ram_threshold bytes, else on scratch
+        self.storage = StoragePolicy(self.scratch, ram_threshold=ram_threshold)
+
+        # parsed header params cached across folder scans
+        if header_index is None:
+            header_index = os.path.join(self.folder, HEADER_INDEX)
+        self.header_index = HeaderIndex(header_index)
+
+        # threads for reading headers during folder scans
+        self.scan_pool = ThreadPoolExecutor(max_workers=scan_workers)
+
+        # loads the study after the current one in the background (prefetch_budget bytes)
+        self.prefetcher = Prefetcher(budget=prefetch_budget, scratch=self.storage)
 
         # default exposure scale
         self.escale = 14.0
@@ -114,18 +151,34 @@ class ImageGUI(tk.Tk):
         self.show_frame("ImageSelector")
 
 
-    def get_files(self):
-        
-        fnames = [os.path.join(dp, f) for dp, dn, filenames in os.walk(self.folder) for f in filenames]
-        pet_files =  [PETImage(f) for f in fnames if is_pet(f)]
-        ct_files = [CTImage(f) for f in fnames if f.endswith('.ct.img')]
-        all_files = pet_files+ct_files
-        all_files.sort(key=lambda x: x.subject_id)
-        groups = defaultdict(list)
-        for img in all_files:
-            groups[img.subject_id].append(img)
-        img_pairs = groups.values()
-        return img_pairs
+    def find_images(self):
+        '''
+        (filepath, image class) for every study in self.folder
+        '''
+        return find_images(self.folder)
+
+    def scan_files(self):
+        '''
+        scans self.folder off the Tk thread; images are built on self.scan_pool from the header
+        index or, for new and changed headers, lazily (parsed once the study is opened or
+        prefetched, and recorded in the index by finish_load); each image is put on the returned
+        queue as soon as it is ready, followed by None once the scan is done
+        '''
+        results = queue.Queue()
+
+        def scan():
+            try:
+                futures = [self.scan_pool.submit(self.header_index.open_image, f, cls, lazy=True) for f,cls in self.find_images()]
+                for future in as_completed(futures):
+                    try:
+                        results.put(future.result())
+                    except Exception as e:
+                        print('Failed to read header in scan_files: {}'.format(e))
+            finally:
+                results.put(None)
+
+        threading.Thread(target=scan, daemon=True).start()
+        return results
         
 
 
@@ -139,29 +192,93 @@ class ImageGUI(tk.Tk):
         except Exception as e:
             print(e)
 
-    def make_splash(self,text='Loading...'):
+    def make_splash(self,text='Loading...',cancel=None):
         self.withdraw()
-        self.splash = LoadScreen(self,text=text)
+        self.splash = LoadScreen(self,text=text,cancel=cancel)
 
     def stop_splash(self):
         self.splash.destroy()
         self.deiconify()
 
-    def load_image(self):
-        tdir = tempfile.mkdtemp()
-        log_temp_dir(tdir)
-        self.image_editor.image.tempdir = tdir
-        self.image_editor.image.load_image()
+    def load_image(self, progress=None):
+        self.image_editor.image.scratch = self.storage
+        self.image_editor.image.load_image(progress=progress)
 
 
     def start_img(self,img):
-        self.make_splash()       
-        self.image_editor = ImageEditor(img,escale=self.escale)
-        self.load_image()
-        self.tempdirs.append(self.image_editor.image.tempdir)
+        '''
+        loads img on a worker thread, or takes it from the prefetcher (other prefetched studies
+        are dropped, a prefetch still in flight reports to the splash); the splash shows the
+        bytes read and lets the user cancel, progress comes back through a queue polled by
+        poll_load; images from a folder scan have their header parsed here
+        '''
+        try:
+            self.image_editor = ImageEditor(img,escale=self.escale)
+        except (ValueError, OSError) as e:
+            print('Failed to read header of {0}: {1}'.format(img.filename, e))
+            return
+        cancel = threading.Event()
+        self.make_splash(cancel=cancel.set)
+        self.prefetcher.keep_only([img])
+        updates = queue.Queue()
+
+        def progress(done, total):
+            updates.put((done, total))
+            return not cancel.is_set()
+
+        def load():
+            try:
+                prefetched = self.prefetcher.take(img, progress=progress)
+                if prefetched is None:
+                    self.load_image(progress=progress)
+                else:
+                    self.image_editor.image = prefetched
+                    if cancel.is_set():
+                        raise LoadCancelled('Loading {} cancelled.'.format(img.filename))
+                updates.put(None)
+            except Exception as e:
+                updates.put(e)
+
+        threading.Thread(target=load, daemon=True).start()
+        self.poll_load(img, updates, time.time())
+
+    def poll_load(self, img, updates, start):
+        '''
+        shows the latest progress from start_img's worker and finishes the load once it is done
+        '''
+        latest = None
+        while True:
+            try:
+                item = updates.get_nowait()
+            except queue.Empty:
+                break
+            if item is None or isinstance(item, Exception):
+                self.finish_load(img, item)
+                return
+            latest = item
+        if latest is not None:
+            self.splash.set_progress(latest[0], latest[1], time.time()-start)
+        self.after(100, self.poll_load, img, updates, start)
+
+    def finish_load(self, img, error=None):
         self.stop_splash()
+        if error is not None:
+            if isinstance(error, LoadCancelled):
+                print(error)
+            else:
+                print('Failed to load {0}: {1}'.format(img.filename, error))
+            self.clean_memmaps()
+            self.show_frame("ImageSelector")
+            return
+        self.header_index.update(img)
+        self.header_index.save()
         self.show_frame("ImageRotator")
 
+        # read ahead while the user works on this study
+        next_img = self.frames['ImageSelector'].next_image(img)
+        if next_img is not None:
+            self.prefetcher.prefetch(next_img)
+
     def init_escaler(self, frame):
         self.adjust_escale(frame)
         try:
@@ -212,30 +329,15 @@ class ImageGUI(tk.Tk):
         coords = self.iicoords
         frame.img_info.place(x=coords[0],y=coords[1])
 
-    def remove_temp_dirs(self):
-        self.clean_memmaps()
-        for directory in self.tempdirs:
-            try:
-                shutil.rmtree(directory)
-                print('Removed tempdir: {}'.format(directory))
-                self.tempdirs.remove(directory)
-            except Exception as e:
-                print('Failed to remove tempdir: {0}\n{1}'.format(directory,e))
-        
     def clean_memmaps(self):
+        '''
+        releases the current image's memmaps to the scratch pool for the next study to reuse
+        '''
         if self.image_editor is not None:
             if self.image_editor.image is not None:
                 self.image_editor.image.clean_cuts()
-                try:
-                    delattr(self.image_editor.image,'img_data')
-                except AttributeError:
-                    pass
-                fn = '{}.dat'.format(self.image_editor.image.filename.split('.')[0])
-                fp = os.path.join(self.image_editor.image.tempdir,fn)
-                if os.path.exists(fp):
-                    os.remove(fp)
+                self.image_editor.image.release_scratch()
         self.image_editor = None
-        gc.collect()
 
 
 class ImageSelector(tk.Frame):
@@ -243,7 +345,7 @@ class ImageSelector(tk.Frame):
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
         self.controller = controller
-        self.controller.remove_temp_dirs()
+        self.controller.clean_memmaps()
         label = tk.Label(self, text="Select Image", font=controller.title_font)
         label.grid(row=0,column=1,columnspan=2,padx=(30,0),pady=(0,20))
         
@@ -266,29 +368,81 @@ class ImageSelector(tk.Frame):
 
 
     def re_init(self):
-        self.controller.remove_temp_dirs() # do this when we select new file
+        self.controller.clean_memmaps() # do this when we select new file
         self.controller.nmice=None
         for b in self.buttons:
             b.destroy()
         self.make_buttons()
 
     def make_buttons(self):
-        img_pairs = self.controller.get_files()
-
+        '''
+        starts a folder scan; buttons are added by poll_scan as headers are read
+        '''
         self.buttons = []
-        for i,pair in enumerate(img_pairs):
+        self.groups = defaultdict(list)
+        self.group_buttons = {}
+        self.scan_results = self.controller.scan_files()
+        self.poll_scan(self.scan_results)
+
+    def poll_scan(self, results):
+        if results is not self.scan_results:
+            return  # superseded by a newer scan
+        changed = set()
+        while True:
             try:
-                im1,im2 = pair
-            except:
-                im1,im2 = pair[0],None
-            for im in [im1,im2]:
-                if im is not None:
-                    column = self.petcol if im.type == 'pet' else self.ctcol
-                    b = tk.Button(self,
-                        text=im.filename,
-                        command = lambda im=im: self.controller.start_img(im))
-                    b.grid(row=i+3,column=column)
-                    self.buttons.append(b)
+                im = results.get_nowait()
+            except queue.Empty:
+                break
+            if im is None:
+                self.layout_buttons(changed)
+                scanned = [im.header_file for group in self.groups.values() for im in group]
+                self.controller.header_index.prune(scanned)
+                self.controller.header_index.save()
+                return
+            self.groups[im.subject_id].append(im)
+            self.groups[im.subject_id].sort(key=lambda x: x.type != 'pet')
+            changed.add(im.subject_id)
+        if changed:
+            self.layout_buttons(changed)
+        self.after(50, self.poll_scan, results)
+
+    def shown_images(self, sid):
+        pair = self.groups[sid]
+        if len(pair) != 2:
+            pair = pair[:1]
+        return pair
+
+    def next_image(self, img):
+        '''
+        the study after img in button order (subject_id, then PET before CT), or None
+        '''
+        order = [im for sid in sorted(self.groups) for im in self.shown_images(sid)]
+        paths = [os.path.abspath(im.filepath) for im in order]
+        path = os.path.abspath(img.filepath)
+        if path not in paths or paths.index(path)+1 == len(order):
+            return None
+        return order[paths.index(path)+1]
+
+    def layout_buttons(self, changed):
+        '''
+        one row per subject_id in sorted order, PET and CT in their own columns;
+        buttons are only rebuilt for the subject_ids in changed, the rest are moved
+        '''
+        for sid in changed:
+            for b in self.group_buttons.get(sid, []):
+                b.destroy()
+                self.buttons.remove(b)
+            self.group_buttons[sid] = []
+            for im in self.shown_images(sid):
+                b = tk.Button(self,
+                    text=im.filename,
+                    command = lambda im=im: self.controller.start_img(im))
+                b.column = self.petcol if im.type == 'pet' else self.ctcol
+                self.buttons.append(b)
+                self.group_buttons[sid].append(b)
+        for i,sid in enumerate(sorted(self.groups)):
+            for b in self.group_buttons[sid]:
+                b.grid(row=i+3,column=b.column)
 
     def browse_file(self):
         Tk().withdraw()
@@ -362,6 +516,7 @@ class ImageRotator(tk.Frame):
         self.controller.init_img_info(self)
         self.controller.init_escaler(self)
         self.init_nmice_select()
+        self.prefill_nmice()
         self.init_ani()
 
 
@@ -381,6 +536,16 @@ class ImageRotator(tk.Frame):
             self.R2.place(x=self.rbx,y=self.rby+20)
             self.R3.place(x=self.rbx,y=self.rby+40)
 
+    def prefill_nmice(self):
+        '''
+        selects the detected number of mice (3 is covered by "3 or 4") for a newly loaded image
+        '''
+        if self.controller.nmice is None and self.controller.image_editor is not None:
+            nmice,cutter = self.controller.image_editor.auto_detect()
+            self.tknmice.set({1:1,2:2}.get(nmice,4))
+            self.set_nmice()
+            self.controller.image_editor.nmice = nmice
+
     def back(self):
         self.controller.image_editor.stop_animation()
         self.controller.show_frame('ImageSelector')
@@ -406,15 +571,24 @@ class ImageRotator(tk.Frame):
                 self.controller.image_editor.image.cuts = [self.controller.image_editor.image] #[SubImage(parent_image=im,img_data=im.img_data,filename='.'.join(fpcs))]
                 self.controller.show_frame('CutViewer')
             else:
+                self.controller.image_editor.auto_cut(keep_placed=True)
                 self.controller.show_frame('ImageCutter')
         else:
             print('Specify number of mice before continuing.')
 
     def set_nmice(self):
+        '''
+        takes the selected number of mice; a cutter (e.g. from detection) that does not give
+        that many cuts is replaced by the default one for the count ("3 or 4" keeps a T)
+        '''
         nmice = self.tknmice.get()
         if nmice is not None:
-            self.controller.image_editor.nmice = self.tknmice.get()
-            self.controller.nmice = self.tknmice.get()
+            editor = self.controller.image_editor
+            editor.nmice = nmice
+            self.controller.nmice = nmice
+            fits = (3,4) if nmice == 4 else (nmice,)
+            if nmice > 1 and editor.cut_map.get(editor.cutter) not in fits:
+                editor.cutter = NMICE_CUTTERS[nmice]
 
 
 class ImageCutter(tk.Frame):
@@ -431,6 +605,7 @@ class ImageCutter(tk.Frame):
         # recenter crosshairs
         rbx,rby = 200,340
         tk.Button(self,text="Recenter",command=self.recenter).place(x=rbx,y=rby)
+        tk.Button(self,text="Auto",command=self.auto_cut).place(x=rbx+85,y=rby)
 
         # choose cutter
         tk.Label(self,text='Choose cutter:').place(x=20,y=220)
@@ -459,6 +634,11 @@ class ImageCutter(tk.Frame):
         
     def recenter(self):
         self.controller.image_editor.cx, self.controller.image_editor.cy = self.controller.image_editor.cx_def, self.controller.image_editor.cy_def
+        self.controller.image_editor.cut_placed = True
+        self.init_ani()
+
+    def auto_cut(self):
+        self.controller.image_editor.auto_cut()
         self.init_ani()
 
 
@@ -485,6 +665,7 @@ class ImageCutter(tk.Frame):
 
     def set_cutter(self,cutter):
         self.controller.image_editor.cutter=cutter
+        self.controller.image_editor.auto_cut(keep_placed=True)
         self.re_init()
 
     def do_cut(self):
@@ -556,53 +737,20 @@ class CutViewer(tk.Frame):
         save_path = askdirectory()
         if save_path:
             self.controller.make_splash(text='Saving images...')
-            self.controller.image_editor.image.save_cuts(path=save_path)
+            # only rotations and cuts are applied in the GUI, so copy the original data
+            self.controller.image_editor.image.save_cuts(path=save_path,raw=True)
             self.controller.stop_splash()
             self.controller.image_editor.stop_animation()
-            self.controller.remove_temp_dirs()
+            self.controller.clean_memmaps()
             self.controller.frames['ImageSelector'].re_init()
             self.controller.show_frame('ImageSelector')
 
 
-def is_pet(fname):
-    if 'pet' in fname and '.ct' not in fname and fname.endswith('.img'):
-        return True
-    else:
-        return False
-
-def clean_temp_dirs():
-    if os.path.exists(TEMPLOG):
-        with open(TEMPLOG,'r') as tlog:
-            tlog_txt = tlog.read()
-        tdirs = list(set([d for d in tlog_txt.split('\n') if d]))
-        for d in tdirs:
-            try:
-                shutil.rmtree(d)
-                print('Removed tempdir: {}'.format(d))
-                tdirs.remove(d)
-            except Exception as e:
-                if not os.path.exists(d):
-                    tdirs.remove(d)
-                else:
-                    print('Failed to remove tempdir: {0}\n{1}'.format(directory,e))
-        with open(TEMPLOG,'w') as tlog:
-            tlog.write('\n'.join(tdirs))
-
-
-def log_temp_dir(directory):
-    if os.path.exists(TEMPLOG):
-        ap_wr = 'a'
-    else:
-        ap_wr = 'w'
-
-    tlog = open(TEMPLOG, ap_wr)
-    tlog.write('\n{}'.format(directory))
-    tlog.close()
-
-
 def exit_fn():
-    app.remove_temp_dirs()
-    clean_temp_dirs()
+    app.scan_pool.shutdown(wait=False, cancel_futures=True)
+    app.prefetcher.shutdown()
+    app.clean_memmaps()
+    app.scratch.close()
     try:
         app.destroy()
     except:
@@ -612,8 +760,6 @@ def exit_fn():
 
 
 if __name__ == "__main__":
-    gc.collect()
-    clean_temp_dirs()
     atexit.register(exit_fn)
     data_folder = os.path.join('data','pcds')
     app = ImageGUI(folder=data_folder)
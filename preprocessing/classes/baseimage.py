@@ -1,26 +1,43 @@
 import os
+import re
 import sys
-import struct
 import numpy as np
 import ntpath
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import warnings
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+
+
+class LoadCancelled(Exception):
+    '''
+    raised by load_image when its progress hook asks to stop
+    '''
+    pass
+
 
 class BaseImage:
 
+    # (keyword regex, Parameters namedtuple) per keyword list; see get_header_index
+    header_indexes = {}
+
     def __init__(self, filepath=None, img_data=None, frame_range=None):
+        self._params = None
+        self.dims = {}  # xdim,ydim,zdim; taken from params on first use unless set
         self.filepath = filepath
         self.img_data = img_data
         self.ax_map = {'z':0,'y':1,'x':2}
-        self.struct_flags = {
-                                1:'B',
-                                2:'h',
-                                3:'i',
-                                4:'f'
-                            }
+        # numpy dtypes for header data_type, with file byte order
+        self.dtypes = {
+                        1:'u1',
+                        2:'<i2',
+                        3:'<i4',
+                        4:'<f4',
+                        5:'>f4',
+                        6:'>i2',
+                        7:'>i4'
+                    }
         self.frame_range = frame_range
         if filepath is not None:
             self.filename = ntpath.basename(filepath)
@@ -34,19 +51,129 @@ class BaseImage:
         self.scaled = None
         self.bpp = None # bytes per pixel
         self.tempdir = None
+        self.scratch = None     # ScratchManager or StoragePolicy for buffers; self.tempdir is used if None
+        self.scratch_maps = []  # buffers allocated by this image, see self.release_scratch
         self.data_lim = 10**7  # 10 MB
 
+        # for self.window
+        self.raw_map = None
+        self.frame_cache = OrderedDict()
+        self.frame_cache_lim = 5*10**8  # 500 MB
 
-    def submemmap(self, ix, data):
-        if self.tempdir is None:
-            raise ValueError('self.tempdir is None in self.sub_memmap.')
+        # axes (z,y,x) currently flipped by rotate_on_axis; img_data itself is never flipped,
+        # the flips are applied to projections, cuts and on export
+        self.orientation = (False,False,False)
+
+        # collapsed img_data by (axis, method), kept in the current orientation; see self.project_all
+        self.projections = {}
+
+        # display reductions of self.projections by (axis, method); see self.pyramid
+        self.pyramids = {}
+
+
+    @property
+    def params(self):
+        '''
+        header parameters; parsed on first access for lazily constructed images
+        '''
+        if self._params is None and getattr(self, 'header_file', None) is not None:
+            self.load_header()
+        return self._params
+
+    @params.setter
+    def params(self, params):
+        self._params = params
+
+    def get_dim(self, dim, kw):
+        if dim not in self.dims:
+            if self.params is None:
+                return None
+            self.dims[dim] = getattr(self.params, kw)
+        return self.dims[dim]
+
+    @property
+    def xdim(self):
+        return self.get_dim('xdim', 'x_dimension')
+
+    @xdim.setter
+    def xdim(self, n):
+        self.dims['xdim'] = n
+
+    @property
+    def ydim(self):
+        return self.get_dim('ydim', 'y_dimension')
+
+    @ydim.setter
+    def ydim(self, n):
+        self.dims['ydim'] = n
+
+    @property
+    def zdim(self):
+        return self.get_dim('zdim', 'z_dimension')
+
+    @zdim.setter
+    def zdim(self, n):
+        self.dims['zdim'] = n
+
+    # header-style aliases, used when writing cut headers
+    x_dimension = xdim
+    y_dimension = ydim
+    z_dimension = zdim
+
+    @property
+    def bounds(self):
+        return {0 : (self.ydim, self.xdim), 
+                1 : (self.xdim, self.zdim),
+                2 : (self.zdim, self.ydim)}
+
+
+    def cut_filename(self, ix):
+        '''
+        filename for cut number ix, e.g. mouse_pet.img -> mouse_pet_s1.img
+        '''
         fnpcs = self.filename.split('.')
         fnpcs[0] = fnpcs[0] + '_s{}'.format(ix)
-        filename = '.'.join(fnpcs)
-        img_temp_name = os.path.join(self.tempdir,'{}.dat'.format(filename.split('.')[0]))
-        if os.path.exists(img_temp_name):
-            os.remove(img_temp_name)
-        dfile = np.memmap(img_temp_name, mode='w+', dtype='float32', shape=data.shape)
+        return '.'.join(fnpcs)
+
+
+    def scratch_buffer(self, name, shape, dtype='float32'):
+        '''
+        new temp buffer from self.scratch if set (RAM or memmap, see StoragePolicy), else a
+        memmap name.dat in self.tempdir; freed by self.release_scratch
+        '''
+        if self.scratch is not None:
+            mmap = self.scratch.allocate(name, shape, dtype=dtype)
+        else:
+            if self.tempdir is None:
+                raise ValueError('Neither self.scratch nor self.tempdir set for temp memmap {}.'.format(name))
+            img_temp_name = os.path.join(self.tempdir,'{}.dat'.format(name))
+            if os.path.exists(img_temp_name):
+                os.remove(img_temp_name)
+            mmap = np.memmap(img_temp_name, mode='w+', dtype=dtype, shape=shape)
+        self.scratch_maps.append(mmap)
+        return mmap
+
+    def release_scratch(self):
+        '''
+        drops img_data and everything cached from it, and frees the temp buffers of this image
+        (in-memory ones go with their last reference)
+        '''
+        self.img_data = None
+        self.projections = {}
+        self.pyramids = {}
+        self.frame_cache = OrderedDict()
+        self.raw_map = None
+        paths = [buf.filename for buf in self.scratch_maps if isinstance(buf, np.memmap)]
+        self.scratch_maps = []
+        for path in paths:
+            if self.scratch is not None:
+                self.scratch.release(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def submemmap(self, ix, data):
+        filename = self.cut_filename(ix)
+        dfile = self.scratch_buffer(filename.split('.')[0], data.shape)
         dfile[:] = data[:]
         return filename, dfile
 
@@ -54,47 +181,153 @@ class BaseImage:
 
     def load_header(self):
         '''
-        parses parameters from header file; checks line by line if line starts with keyword;
+        parses parameters from header file in a single pass; each line is matched against a compiled
+        index of the keywords and dispatched to that keyword's handler;
         uses first instance of keyword unless keyword in per_frame (in which case uses np.array)
         '''
-        hdr_file = open(self.header_file, 'r')
-        hdr_string = hdr_file.read()
-        hdr_lines = hdr_string.split('\n')
-
         kwrds = self.keywords
         integers = self.integers
         per_frame = self.per_frame
         params = {kw : None for kw in kwrds}
+        frame_vals = {kw : [] for kw in per_frame}
+        kw_index, Parameters = self.get_header_index()
+
+        def first_value(kw, convert):
+            def handler(ks):
+                if params[kw] is None:
+                    params[kw] = convert(ks)
+            return handler
 
+        handlers = {}
         for kw in kwrds:
-            for line in hdr_lines:
-                kv = params[kw]
+            if kw in per_frame:
+                handlers[kw] = lambda ks, vals=frame_vals[kw]: vals.append(float(ks))
+            elif kw in integers:
+                handlers[kw] = first_value(kw, int)
+            else:
+                handlers[kw] = first_value(kw, float)
+
+        with open(self.header_file, 'r') as hdr_file:
+            for line in hdr_file:
+                line = line.strip()
+                match = kw_index.match(line)
+                if match is None:
+                    continue
                 try:
-                    if kw == line.strip()[0:len(kw)]:
-                        if kw in per_frame:
-                            if kv is None:
-                                params[kw] = np.array([])
-                            params[kw] = np.append(params[kw], float(line.strip().split(' ')[1]))
-                        elif kv is None:
-                            ks = line.strip().split(' ')[1]
-                            if kw in integers:
-                                params[kw] = int(ks)
-                            else:
-                                params[kw] = float(ks)
+                    handlers[match.group(0)](line.split(' ')[1])
                 except IndexError:
                     pass
 
+        for kw in per_frame:
+            if frame_vals[kw]:
+                params[kw] = np.array(frame_vals[kw])
+
         failed = [kw for kw in kwrds if params[kw] is None]
         if any(failed):
             raise ValueError('Failed to parse parameters: {}'.format(', '.join(failed)))
-        hdr_file.close()
     
-        Parameters = namedtuple('Parameters',' '.join(kwrds))
         self.params = Parameters(**params)
         return
 
 
-    def load_image(self,plane_range=None,frame_range=None,unscaled=False):
+    def set_params(self, params):
+        '''
+        sets self.params from a dict of already-parsed header values (e.g. from a HeaderIndex)
+        '''
+        Parameters = self.get_header_index()[1]
+        params = {kw : (np.array(params[kw]) if kw in self.per_frame else params[kw]) for kw in self.keywords}
+        self.params = Parameters(**params)
+
+
+    def get_header_index(self):
+        '''
+        compiled keyword regex and Parameters namedtuple for self.keywords; built once per keyword
+        list and shared by all images of that type
+        '''
+        key = tuple(self.keywords)
+        if key not in BaseImage.header_indexes:
+            # longest first so the regex prefers the most specific keyword
+            kws = sorted(self.keywords, key=len, reverse=True)
+            kw_index = re.compile('|'.join(re.escape(kw) for kw in kws))
+            Parameters = namedtuple('Parameters',' '.join(self.keywords))
+            BaseImage.header_indexes[key] = (kw_index, Parameters)
+        return BaseImage.header_indexes[key]
+
+
+    def get_dtype(self):
+        '''
+        numpy dtype (including byte order) of the raw image file, from header data_type
+        '''
+        try:
+            return np.dtype(self.dtypes[self.params.data_type])
+        except KeyError:
+            raise ValueError('Unsupported data_type in header: {}'.format(self.params.data_type))
+
+
+    def map_image(self):
+        '''
+        maps the raw image file as a read-only typed np.memmap with shape (frames, z, y, x);
+        indexing the map is a strided view, so only the planes/frames actually touched are paged in
+        '''
+        ps = self.params
+        shape = (ps.total_frames, ps.z_dimension, ps.y_dimension, ps.x_dimension)
+        return np.memmap(self.filepath, mode='r', dtype=self.get_dtype(), shape=shape)
+
+
+    def get_range(self, rng, n, name):
+        '''
+        normalizes a plane or frame range input (see load_image) to [first,last] for n planes/frames
+        '''
+        if rng is None:
+            return [0, max(n-1, 0)]
+        elif type(rng) is int:
+            return [rng,rng]
+        rng = list(rng)
+        if rng[-1] >= n:
+            rng[-1] = n-1
+            warnings.warn('Input {0} range exceeds number of {0}s in data file.  Using {0}s {1}.'.format(name,rng))
+        return rng
+
+
+    def window(self, planes=None, frames=None):
+        '''
+        scaled float32 data for a range of planes and frames, shape (z,y,x,frames), read on demand
+        from the raw file instead of load_image's full copy; planes/frames take the same input as
+        load_image's plane_range/frame_range; data is in file orientation; used by get_frame (and
+        so ImageEditor.animate_along_axis and view_each_axis with a frame_range) on images that
+        were not loaded; the GUI still loads the whole study, which rotating and cutting need
+        '''
+        pl = self.get_range(planes, self.params.z_dimension, 'z-plane')
+        fr = self.get_range(frames, self.params.total_frames, 'frame')
+        mats = [self.get_scaled_frame(f, pl) for f in range(fr[0],fr[1]+1)]
+        return np.stack(mats, axis=-1)
+
+
+    def get_scaled_frame(self, n, plane_range):
+        '''
+        scaled planes [first,last] of frame n; whole frames no larger than self.frame_cache_lim
+        bytes are scaled once and kept in an LRU (self.frame_cache) of at most that many bytes
+        '''
+        p1,p2 = plane_range
+        if n in self.frame_cache:
+            self.frame_cache.move_to_end(n)
+            return self.frame_cache[n][p1:p2+1]
+
+        if self.raw_map is None:
+            self.raw_map = self.map_image()
+        frame = self.raw_map[n]
+        scale_factor = np.float32(np.atleast_1d(self.params.scale_factor)[n])
+        if frame.size*4 > self.frame_cache_lim:
+            return np.multiply(frame[p1:p2+1], scale_factor, dtype='float32')
+
+        frame = np.multiply(frame, scale_factor, dtype='float32')
+        self.frame_cache[n] = frame
+        while sum(f.nbytes for f in self.frame_cache.values()) > self.frame_cache_lim:
+            self.frame_cache.popitem(last=False)
+        return frame[p1:p2+1]
+
+
+    def load_image(self,plane_range=None,frame_range=None,unscaled=False,mapped=False,progress=None):
         '''
         - loads specified frames into np.ndarray
         - can do range of frames now; maybe implement list of frames
@@ -107,29 +340,34 @@ class BaseImage:
         - for single plane or single frame, just give n where n is the index
         of the plane or frame to include; 
         - index from 0, e.g. for the first 40 planes, use [0,39]
+        - mapped=True skips the temp file: img_data is an unscaled (z,y,x,frames) view of the raw
+        file in its own dtype, and self.scale_factor holds the factors to apply
+        - progress(bytes_read, total_bytes) is called after every block read; if it returns False
+        the temp memmap is released and removed and LoadCancelled is raised
         '''
-        def read_chunks(ifr):
+        def read_chunks(i, ifr, scale_factor=None):
             '''
-            Trying to read data in chunks to handle HiResCt images
+            Copies frame ifr from the raw file map into row i of imgmat in blocks of whole
+            planes (at most self.data_lim bytes each) to handle HiResCt images; if given,
+            scale_factor is applied to each block as it is copied; returns False if progress
+            asked to stop
             '''
-            to_read = bpp*matsize
-            read_lim = self.data_lim
-            print('Will read {0} {1}MB chunks.'.format(to_read/read_lim,int(read_lim/10**6)))
-            ix = 0
-            while to_read > read_lim:
-                print('Reading new chunk; {}MB left'.format(int(to_read/10**6)))
-                nbytes = read_lim
-                npixels = int(nbytes/bpp)
-                chunk = np.array(struct.unpack(sf*npixels,img_file.read(nbytes)))
-                imgmat[ifr][ix:ix+npixels] = chunk
-                to_read -= read_lim
-                ix+=npixels
-
-            print('Reading new chunk; {}MB left'.format(int(to_read/10**6)))
-            nbytes = to_read
-            npixels = int(nbytes/bpp)
-            chunk = np.array(struct.unpack(sf*npixels,img_file.read(nbytes)))
-            imgmat[ifr][ix:ix+npixels] = chunk
+            frame = raw[ifr, pl1:pl2+1]
+            plane_size = ps.x_dimension*ps.y_dimension
+            step = max(1, int(self.data_lim/(bpp*plane_size)))
+            print('Will read {0} {1}MB chunks.'.format(bpp*matsize/self.data_lim,int(self.data_lim/10**6)))
+            for z0 in range(0, nplanes, step):
+                z1 = min(z0+step, nplanes)
+                block = imgmat[i][z0*plane_size:z1*plane_size].reshape(z1-z0,ps.y_dimension,ps.x_dimension)
+                if scale_factor is None:
+                    block[:] = frame[z0:z1]
+                else:
+                    np.multiply(frame[z0:z1], scale_factor, out=block, casting='unsafe')
+                if progress is not None:
+                    nread[0] += (z1-z0)*plane_size*bpp
+                    if progress(nread[0], total) is False:
+                        return False
+            return True
 
 
 
@@ -137,32 +375,8 @@ class BaseImage:
         print('File dimensions: ({},{},{},{})'.format(x,y,z,fs))
         ps = self.params
 
-        if plane_range is None:
-            if ps.z_dimension > 1:
-                plane_range = [0, ps.z_dimension-1]
-            else:
-                plane_range = [0,0]
-        elif type(plane_range) is int:
-            plane_range = [plane_range,plane_range]
-        else:
-            plane_range = list(plane_range)
-            if plane_range[-1] >= self.params.z_dimension:
-                plane_range[-1] = self.params.z_dimension-1
-                warnings.warn('Input z-plane range exceeds number of z-planes in data file.  Usings z-planes {}.'.format(plane_range))
-
-
-        if frame_range is None:
-            if ps.total_frames > 1:
-                frame_range = [0, ps.total_frames-1]
-            else:
-                frame_range = [0,0]
-        elif type(frame_range) is int:
-            frame_range = [frame_range,frame_range]
-        else:
-            frame_range = list(frame_range)
-            if frame_range[-1] >= self.params.total_frames:
-                frame_range[-1] = self.params.total_frames-1
-                warnings.warn('Input frame range exceeds number of frames in data file.  Usings frames {}.'.format(frame_range))
+        plane_range = self.get_range(plane_range, ps.z_dimension, 'z-plane')
+        frame_range = self.get_range(frame_range, ps.total_frames, 'frame')
 
 
         if plane_range[1]>plane_range[0]:
@@ -177,6 +391,8 @@ class BaseImage:
 
         pl,fr = plane_range,frame_range
         self.plane_range,self.frame_range = pl,fr
+        self.projections = {}
+        self.pyramids = {}
 
         
         # some calcs with params
@@ -223,90 +439,95 @@ class BaseImage:
                 
             
         # file data format parameters
-        bytes_per_pixel = {
-            1:1,
-            2:2,
-            3:4,
-            4:4
-        }
-
-        bpp = bytes_per_pixel[ps.data_type]
+        dtype = self.get_dtype()
+        bpp = dtype.itemsize
         self.bpp = bpp
-        sf = self.struct_flags[ps.data_type]
+
+        # map data file; nothing is read until the map is indexed
+        raw = self.map_image()
+        matsize = ps.x_dimension*ps.y_dimension*nplanes
+
+        if mapped:
+            self.img_data = raw[fr1:fr2+1, pl1:pl2+1].transpose(1,2,3,0)
+            self.scale_factor = ps.scale_factor[fr1:fr2+1] if multi_frame else ps.scale_factor[fr1]
+            self.scaled = False
+            return
 
         # read data from file
         print('Reading image data...')
-        
-        img_file = open(self.filepath,'rb')
-        matsize = ps.x_dimension*ps.y_dimension*nplanes
-        pl_offset = pl[0]*(ps.x_dimension*ps.y_dimension)
 
         # make tempfile for whole image
-        img_temp_name = os.path.join(self.tempdir,'{}.dat'.format(self.filename.split('.')[0]))
-        imgmat = np.memmap(img_temp_name,mode='w+',dtype='float32',shape=(nframes,matsize))
+        self.release_scratch()
+        imgmat = self.scratch_buffer(self.filename.split('.')[0], (nframes,matsize))
+        nread,total = [0],bpp*matsize*nframes
         
-        for ifr in frames:  
-            fr_offset = ifr*(ps.x_dimension*ps.y_dimension*ps.z_dimension)
-            img_file.seek(bpp*(fr_offset+pl_offset))
-            read_chunks(ifr)
-        imgmat = imgmat.swapaxes(0,1)
-        img_file.close()
-
-        # scale data
+        # scale data while reading
+        for i,ifr in enumerate(frames):
+            if not read_chunks(i, ifr, None if unscaled else np.float32(ps.scale_factor[ifr])):
+                del raw, imgmat
+                self.release_scratch()
+                raise LoadCancelled('Loading {} cancelled.'.format(self.filename))
+
         if unscaled:
-            self.img_data = imgmat
+            self.img_data = imgmat.swapaxes(0,1)
             self.scaled = False
         else:
-            imgmat = imgmat.reshape(nplanes,ps.x_dimension,ps.y_dimension,nframes)
-            if multi_plane and (not multi_frame):
-                imgmat = imgmat[0:nplanes,:,:,0]
-                self.scale_factor = ps.scale_factor[fr1]
-            elif (not multi_plane) and multi_frame:
-                imgmat = imgmat[0,:,:,0:nframes]
-                self.scale_factor = ps.scale_factor[fr1:fr2+1]
-            elif (not multi_plane) and (not multi_frame):
-                imgmat = imgmat[0,:,:,0]
-                self.scale_factor = ps.scale_factor[fr1]
-            else: 
-                imgmat = imgmat[0:nplanes,:,:,0:nframes]      
-                self.scale_factor = ps.scale_factor[fr1:fr2+1]
-            imgmat = imgmat*self.scale_factor
-            self.img_data = imgmat.reshape(nplanes,ps.y_dimension,ps.x_dimension,nframes)
+            self.scale_factor = ps.scale_factor[fr1:fr2+1] if multi_frame else ps.scale_factor[fr1]
+            # (z,y,x,frames) view of the frame-major temp buffer
+            self.img_data = imgmat.reshape(nframes,nplanes,ps.y_dimension,ps.x_dimension).transpose(1,2,3,0)
             self.scaled = True
+        del raw
 
         return
 
 
-    def save_cuts(self,path):
-
+    def raw_view(self):
+        '''
+        unscaled (z,y,x,frames) view of the raw file over the loaded planes and frames, in the
+        image's current orientation; nothing is read until the view is indexed
+        '''
+        if self.frame_range is None or self.plane_range is None:
+            raise ValueError('Image data has not been loaded in self.raw_view. Use image.load_image()')
+        fr1,fr2 = self.frame_range
+        pl1,pl2 = self.plane_range
+        data = self.map_image()[fr1:fr2+1, pl1:pl2+1].transpose(1,2,3,0)
+        flipped = [ax for ax,f in enumerate(self.orientation) if f]
+        if flipped:
+            data = np.flip(data, flipped)
+        return data
+
+
+    def save_cuts(self,path,raw=False):
+        '''
+        writes each cut and its header to path;
+        raw=True copies each cut's region straight from the original image file (with rotations
+        applied) in its own dtype, skipping the float data; for studies that were only rotated
+        and cut this gives the same values without the unscale/round trip
+        '''
 
-        def write_chunks(data, dfile):
+        def write_chunks(data, dfile, scaled):
             '''
-            Trying to read data in chunks to handle HiResCt images
+            Writes (z,y,x,frames) data out frame-major straight from the array buffer, in blocks
+            of whole planes (at most self.data_lim bytes each) so memory use stays flat; scaling
+            is undone and the target dtype applied per block
             '''
             if self.bpp is None:
                 raise ValueError('self.bpp not defined in self.save_cuts')
             bpp = self.bpp
 
-            total_pixels = len(data)
-            bytes_to_write = total_pixels*bpp
+            nz,ny,nx,nf = data.shape
+            step = max(1, int(self.data_lim/(bpp*ny*nx)))
             write_lim = self.data_lim
-            print('Will read {0} {1}MB chunks.'.format(bytes_to_write/write_lim,int(write_lim/10**6)))
-            ix = 0
-            while bytes_to_write > write_lim:
-                print('Writing new chunk; {}MB left'.format(int(bytes_to_write/10**6)))
-                nbytes = write_lim
-                npixels = int(nbytes/bpp)
-                chunk = data[ix:ix+npixels]
-                dfile.write(struct.pack(npixels*sf, *chunk))
-                bytes_to_write -= write_lim
-                ix += npixels
-
-            print('Writing new chunk; {}MB left'.format(int(bytes_to_write/10**6)))
-            nbytes = bytes_to_write
-            npixels = int(nbytes/bpp)
-            chunk = data[ix:ix+npixels]
-            dfile.write(struct.pack(npixels*sf, *chunk))
+            print('Will write {0} {1}MB chunks.'.format(data.size*bpp/write_lim,int(write_lim/10**6)))
+            for f in range(nf):
+                for z0 in range(0, nz, step):
+                    chunk = data[z0:z0+step,:,:,f]
+                    if scaled:
+                        chunk = chunk/scale_factor[f]
+                    # make sure data is int if it is supposed to be
+                    if dtype.kind in 'iu' and chunk.dtype.kind == 'f':
+                        chunk = np.rint(chunk)
+                    chunk.astype(dtype).tofile(dfile)
             return
 
 
@@ -316,7 +537,11 @@ class BaseImage:
             raise ValueError('Image has not been cut in BaseImage.save_cuts()')
         if path is None:
             raise ValueError('Path not specified')
-        sf  = self.struct_flags[self.params.data_type]
+        dtype = self.get_dtype()
+        scale_factor = np.atleast_1d(self.scale_factor)
+        if raw:
+            raw_data = self.raw_view()
+            self.bpp = dtype.itemsize
 
         hdr_file = open(self.header_file, 'r')
         hdr_string = hdr_file.read()
@@ -335,25 +560,11 @@ class BaseImage:
             with open(os.path.join(path,cut_hdr_name),'w') as hf:
                 hf.write(cut_hdr_str)
 
-            out_data = cut_img.img_data
-            out_data = out_data.reshape(cut_img.xdim*cut_img.ydim*cut_img.zdim,cut_img.nframes)
-            # out_data.resize((cut_img.xdim*cut_img.ydim*cut_img.zdim,cut_img.nframes),refcheck=False)
-            if self.scaled:
-                inv = lambda x: 1/x
-                v_inv = np.vectorize(inv)
-                inv_scale_factor = v_inv(self.scale_factor)
-                out_data = out_data*inv_scale_factor
-
-            # prepare data to write out
-            out_data = out_data.swapaxes(0,1).flatten()
-            
-            # make sure data is int if it is supposed to be
-            if sf in ['i','B','h']:
-                out_data = out_data.astype(int)
-
             with open(os.path.join(path,cut_filename),'wb') as dfile:
-                write_chunks(out_data,dfile)
-                # dfile.write(struct.pack(nd*sf,*out_data))
+                if raw:
+                    write_chunks(raw_data[getattr(cut_img,'region',np.s_[:,:,:])],dfile,scaled=False)
+                else:
+                    write_chunks(cut_img.oriented_data(),dfile,scaled=self.scaled)
             print('File saved.')
 
     def clean_cuts(self):
@@ -361,14 +572,9 @@ class BaseImage:
         remove existing cuts
         '''
         for cut in self.cuts:
-            try:
-                delattr(cut,'img_data')
-            except AttributeError:
-                pass
-            fn = '{}.dat'.format(cut.filename.split('.')[0])
-            fp = os.path.join(self.tempdir,fn)
-            if os.path.exists(fp):
-                os.remove(fp)
+            if cut is not self:
+                cut.release_scratch()
+        self.cuts = []
 
     def get_axis(self,axis):
         '''
@@ -392,7 +598,11 @@ class BaseImage:
 
 
     def get_frame(self,n):
-        
+
+        # not loaded; read just this frame from the file
+        if self.img_data is None and self.filepath is not None:
+            return self.oriented_data(self.window(frames=n))[:,:,:,0]
+
         self.check_data()
        
         if self.frame_range is None:
@@ -401,11 +611,11 @@ class BaseImage:
         f1,f2 = tuple(self.frame_range)
         if n not in range(f1,f2+1):
             raise IndexError('Specified frame {0} is not in loaded range {1}'.format(n,self.frame_range))
-        return self.img_data[:,:,:,f1-n]
+        return self.oriented_data()[:,:,:,n-f1]
 
     def collapse_frame(self,axis,frame=None,method='sum'):
         if frame is None:
-            matrix = self.img_data
+            matrix = self.oriented_data()
         else:
             matrix = self.get_frame(frame)
         ax = self.get_axis(axis)
@@ -415,17 +625,145 @@ class BaseImage:
 
     def collapse_over_frames(self,method,matrix=None):
         if matrix is None:
-            matrix = self.img_data
+            matrix = self.oriented_data()
         self.check_collapse_method(method)
-        return getattr(self.img_data,method)(axis=3)
+        return getattr(matrix,method)(axis=3)
+
+    def oriented_data(self, data=None):
+        '''
+        img_data (or data of the same layout, e.g. from self.window) as currently rotated (a
+        flipped view)
+        '''
+        if data is None:
+            self.check_data()
+            data = self.img_data
+        flipped = [ax for ax,f in enumerate(self.orientation) if f]
+        if flipped:
+            return np.flip(data, flipped)
+        return data
+
+    def orient_projection(self,axis,proj,orientation=None):
+        '''
+        flips a projection over axis by orientation (default self.orientation); returns a view
+        '''
+        if orientation is None:
+            orientation = self.orientation
+        remaining = [ax for ax in range(3) if ax != axis]
+        flipped = [i for i,ax in enumerate(remaining) if orientation[ax]]
+        if flipped:
+            return np.flip(proj, flipped)
+        return proj
+
+    def physical_region(self,region):
+        '''
+        maps a (z,y,x) region of slices in the current orientation to the same voxels of img_data
+        '''
+        phys = []
+        for ax,sl in enumerate(region):
+            n = self.img_data.shape[ax]
+            start,stop,_ = sl.indices(n)
+            stop = max(start,stop)
+            if self.orientation[ax]:
+                start,stop = n-stop,n-start
+            phys.append(slice(start,stop))
+        return tuple(phys)
+
+    def project(self,axis,method='sum'):
+        '''
+        img_data collapsed over axis with method, in the current orientation; computed once per
+        (axis, method) and kept in self.projections, which rotate_on_axis updates by flipping
+        '''
+        ax = self.get_axis(axis)
+        return self.project_all(method)[ax]
+
+    def project_all(self,method='sum'):
+        '''
+        [z, y, x] projections of img_data, shapes (y,x,frames), (z,x,frames) and (z,y,frames),
+        built in a single streaming pass over the volume (plane blocks of at most self.data_lim
+        bytes, frame by frame) and stored in self.projections in the current orientation; with
+        self.scratch set the projections are scratch buffers (RAM or disk by size), written in
+        place through flipped views
+        '''
+        self.check_data()
+        self.check_collapse_method(method)
+        keys = [(ax, method) for ax in range(3)]
+        if all(k in self.projections for k in keys):
+            return [self.projections[k] for k in keys]
+
+        data = self.img_data
+        nz,ny,nx,nf = data.shape
+        reduce = np.max if method == 'max' else np.sum
+        dtype = data.dtype if method == 'max' else np.float64
+        shapes = [(ny,nx,nf), (nz,nx,nf), (nz,ny,nf)]
+        if self.scratch is not None:
+            name = '{0}_{1}'.format(self.filename.split('.')[0], method)
+            bufs = [self.scratch_buffer(name, shape, dtype) for shape in shapes]
+        else:
+            bufs = [np.empty(shape, dtype=dtype) for shape in shapes]
+        # flips are their own inverse, so filling the flipped views leaves bufs oriented
+        zproj,yproj,xproj = [self.orient_projection(ax,buf) for ax,buf in enumerate(bufs)]
+
+        step = max(1, int(self.data_lim/(data.itemsize*ny*nx)))
+        for f in range(nf):
+            for z0 in range(0, nz, step):
+                block = np.ascontiguousarray(data[z0:z0+step,:,:,f])
+                z1 = z0+block.shape[0]
+                yproj[z0:z1,:,f] = reduce(block, axis=1)
+                xproj[z0:z1,:,f] = reduce(block, axis=2)
+                zblock = reduce(block, axis=0)
+                if z0 == 0:
+                    zproj[:,:,f] = zblock
+                elif method == 'max':
+                    np.maximum(zproj[:,:,f], zblock, out=zproj[:,:,f])
+                else:
+                    zproj[:,:,f] += zblock
+
+        if method == 'mean':
+            zproj /= nz
+            yproj /= ny
+            xproj /= nx
+
+        for ax,buf in enumerate(bufs):
+            self.projections[keys[ax]] = buf
+        return [self.projections[k] for k in keys]
+
+    def pyramid(self,axis,method='sum',k=1):
+        '''
+        projection on axis reduced k times (k a power of 2) for display: levels halve the one
+        below with block max for method 'max' and block mean otherwise (odd edges padded with
+        the edge value), are built once from the cached projection and kept in self.pyramids;
+        index (i,j) of level k covers rows i*k:(i+1)*k and columns j*k:(j+1)*k
+        '''
+        if k < 1 or k & (k-1):
+            raise ValueError('Pyramid reduction must be a power of 2, got {}'.format(k))
+        ax = self.get_axis(axis)
+        levels = self.pyramids.get((ax,method))
+        if levels is None:
+            levels = self.pyramids[(ax,method)] = [self.project(ax,method)]
+        while 2**(len(levels)-1) < k:
+            prev = levels[-1]
+            ny,nx = -(-prev.shape[0]//2), -(-prev.shape[1]//2)
+            prev = np.pad(prev, ((0,2*ny-prev.shape[0]),(0,2*nx-prev.shape[1]),(0,0)), mode='edge')
+            blocks = prev.reshape(ny,2,nx,2,-1)
+            levels.append(blocks.max(axis=(1,3)) if method == 'max' else blocks.mean(axis=(1,3)))
+        return levels[k.bit_length()-1]
 
     def rotate_on_axis(self, axis):
+        '''
+        180 degree rotation about axis; recorded in self.orientation, the data is not touched and
+        cached projections are flipped in place of being recomputed (cost is the projection size)
+        '''
         self.check_data()
         axis = self.get_axis(axis)
         axes_to_flip = [0,1,2]
         axes_to_flip.remove(axis)
-        self.img_data = np.flip(self.img_data,axes_to_flip[0])
-        self.img_data = np.flip(self.img_data,axes_to_flip[1])
+        flips = tuple(ax in axes_to_flip for ax in range(3))
+        self.orientation = tuple(flipped ^ flip for flipped,flip in zip(self.orientation,flips))
+        for (ax,method),proj in self.projections.items():
+            # in place, keeping the projection's backing store
+            proj[...] = self.orient_projection(ax,proj,flips)
+        # padding makes reduced levels not flip exactly; rebuilt from the flipped projections
+        self.pyramids = {}
 
     def split_on_axis(self,matrix,axis):
         axis = self.get_axis(axis)
@@ -436,32 +774,45 @@ class BaseImage:
 
 class SubImage(BaseImage):
 
-    def __init__(self, parent_image, img_data, filename):
-
-        # make tempfile
+    def __init__(self, parent_image, region, filename):
+        '''
+        region of parent_image given by region, a tuple of (z,y,x) slices in the parent's current
+        orientation; img_data is an unflipped view of the parent's data and the orientation is
+        inherited, so nothing is copied until the cut is written out by save_cuts
+        '''
         self.filename = filename
 
-        BaseImage.__init__(self, filepath='./{}'.format(self.filename), img_data=img_data)
+        phys_region = parent_image.physical_region(region)
+        BaseImage.__init__(self, filepath='./{}'.format(self.filename), img_data=parent_image.img_data[phys_region])
         self.type = parent_image.type
         self.parent_image = parent_image
+        self.region = region
+        self.orientation = parent_image.orientation
         self.frame_range = parent_image.frame_range
         self.plane_range = parent_image.plane_range
         self.scaled = parent_image.scaled
+        self.scratch = parent_image.scratch  # for the cut's projections; freed by clean_cuts
+
+        # hold a reference to the parent's scratch file while this cut maps it, so releasing the
+        # parent first does not hand the file to another allocation
+        path = getattr(self.img_data, 'filename', None)
+        owned = [buf.filename for buf in parent_image.scratch_maps if isinstance(buf, np.memmap)]
+        if self.scratch is not None and path is not None and path in owned:
+            self.scratch.acquire(path)
+            self.scratch_maps.append(self.img_data)
         shape = self.img_data.shape
         self.zdim, self.ydim, self.xdim, self.nframes = shape
-        self.x_dimension,self.y_dimension,self.z_dimension = self.xdim,self.ydim,self.zdim
-        self.bounds={0 : (self.ydim, self.xdim), 
-                    1 : (self.xdim, self.zdim),
-                    2 : (self.zdim, self.ydim)}
 
 
 
 # make so can initialize with np matrix
 class PETImage(BaseImage):
 
-    def __init__(self, filepath, img_data=None):
+    def __init__(self, filepath, img_data=None, params=None, lazy=False):
         '''
-        Needs header file and data file in same directory
+        Needs header file and data file in same directory;
+        params: dict of already-parsed header values, skips parsing the header file;
+        lazy: defer parsing the header until params/dimensions are first used
         '''
         BaseImage.__init__(self, filepath, img_data)
         self.type = 'pet'
@@ -487,19 +838,14 @@ class PETImage(BaseImage):
 
         self.header_file = filepath+'.hdr'
 
-        self.load_header()  # initialize params
-        self.xdim = self.params.x_dimension
-        self.ydim = self.params.y_dimension
-        self.zdim = self.params.z_dimension
-        self.x_dimension,self.y_dimension,self.z_dimension = self.xdim,self.ydim,self.zdim
+        if params is not None:
+            self.set_params(params)
+        elif not lazy:
+            self.load_header()  # initialize params
 
         self.frame_range = None
         self.plane_range = None
         self.nframes = None
-
-        self.bounds={0 : (self.ydim, self.xdim), 
-                    1 : (self.xdim, self.zdim),
-                    2 : (self.zdim, self.ydim)}
         self.scaled = None
 
         
@@ -509,7 +855,7 @@ class PETImage(BaseImage):
 
 class CTImage(BaseImage):
 
-    def __init__(self, filepath, img_data=None):
+    def __init__(self, filepath, img_data=None, params=None, lazy=False):
         BaseImage.__init__(self, filepath=filepath, img_data=img_data)
         self.type = 'ct'
         self.params = None
@@ -528,19 +874,29 @@ class CTImage(BaseImage):
 
         self.integers = ['data_type','z_dimension','total_frames','x_dimension','y_dimension']
         self.per_frame = ['scale_factor','frame_duration'] 
-        self.load_header()
-        self.xdim = self.params.x_dimension
-        self.ydim = self.params.y_dimension
-        self.zdim = self.params.z_dimension
-        self.x_dimension,self.y_dimension,self.z_dimension = self.xdim,self.ydim,self.zdim
+        if params is not None:
+            self.set_params(params)
+        elif not lazy:
+            self.load_header()
 
         self.frame_range = None
         self.plane_range = None
         self.nframes = None
-
-        self.bounds={0 : (self.ydim, self.xdim), 
-                    1 : (self.xdim, self.zdim),
-                    2 : (self.zdim, self.ydim)}
         self.scaled = None
 
 
+
+def is_pet(fname):
+    if 'pet' in fname and '.ct' not in fname and fname.endswith('.img'):
+        return True
+    else:
+        return False
+
+def find_images(folder):
+    '''
+    (filepath, image class) for every PET and CT study under folder
+    '''
+    fnames = [os.path.join(dp, f) for dp, dn, filenames in os.walk(folder) for f in filenames]
+    pet_files = [(f, PETImage) for f in fnames if is_pet(f)]
+    ct_files = [(f, CTImage) for f in fnames if f.endswith('.ct.img')]
+    return pet_files+ct_files
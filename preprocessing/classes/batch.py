@@ -0,0 +1,216 @@
+import os
+import json
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from .baseimage import PETImage, CTImage, is_pet, find_images
+from .imageviewer import ImageEditor
+from .scratch import ScratchManager
+from .storage import StoragePolicy
+
+# per-study settings and their defaults; see cut_study
+STUDY_DEFAULTS = {
+    'cutter' : None,
+    'nmice' : None,
+    'cx' : None,
+    'cy' : None,
+    'rotations' : []
+}
+
+# cutter used when only nmice is known
+NMICE_CUTTERS = {1 : 'no_cut', 2 : 'vertical', 3 : 'up_T', 4 : 'cross'}
+
+
+def open_image(filepath):
+    if filepath.endswith('.hdr'):
+        filepath = filepath[:-len('.hdr')]
+    if is_pet(os.path.basename(filepath)):
+        return PETImage(filepath)
+    return CTImage(filepath)
+
+
+def cut_study(filepath, out_dir, cutter=None, nmice=None, cx=None, cy=None, rotations=(), raw=True, data_lim=None,
+              scratch_root=None, ram_threshold=None):
+    '''
+    load -> rotate -> cut -> save for one study, without any display;
+    same steps as the GUI: nmice=1 saves the whole (rotated) image as _s1, otherwise the image is
+    cut with cutter at (cx,cy); nmice and cutter are detected by ImageEditor.detect_mice and
+    (cx,cy) placed by ImageEditor.auto_cut_points if not given (a missing cutter that detection
+    cannot supply for the given nmice comes from NMICE_CUTTERS; a cutter that does not give
+    nmice cuts raises ValueError); rotations is a list of axes
+    ('x','y','z') applied in order; raw=True copies the original data into the cuts (see
+    BaseImage.save_cuts), raw=False goes through the scaled float data, in RAM or in a scratch
+    session under scratch_root by size (see StoragePolicy; ram_threshold overrides its largest
+    in-memory buffer in bytes); data_lim overrides the image's read/write block size
+    in bytes; returns the saved filenames
+    '''
+    img = open_image(filepath)
+    if data_lim is not None:
+        img.data_lim = data_lim
+    editor = ImageEditor(img, nmice=nmice)
+    if nmice is not None:
+        editor.check_nmice()
+    scratch = None
+    if raw:
+        img.load_image(mapped=True)
+    else:
+        scratch = ScratchManager(root=scratch_root)
+        if ram_threshold is None:
+            img.scratch = StoragePolicy(scratch)
+        else:
+            img.scratch = StoragePolicy(scratch, ram_threshold=ram_threshold)
+        try:
+            img.load_image()
+        except Exception:
+            scratch.close()
+            raise
+
+    try:
+        for ax in rotations:
+            img.rotate_on_axis(ax)
+
+        if nmice is None or cutter is None:
+            found,found_cutter = editor.detect_mice()
+            if nmice is None:
+                nmice = editor.nmice = found
+                print('Detected {0} mice in {1}'.format(nmice, img.filename))
+            if cutter is None:
+                cutter = found_cutter if found == nmice else None
+        if cutter is None:
+            cutter = NMICE_CUTTERS[nmice]
+        if nmice != 1 and editor.cut_map.get(cutter) != nmice:
+            raise ValueError('Cutter {0} does not give {1} cuts for {2}.'.format(cutter, nmice, img.filename))
+
+        if nmice == 1:
+            img.filename = img.cut_filename(1)
+            img.cuts = [img]
+        else:
+            editor.cutter = cutter
+            if cx is None or cy is None:
+                editor.auto_cut()
+            if cx is not None:
+                editor.cx = int(cx)
+            if cy is not None:
+                editor.cy = int(cy)
+            editor.cut_image()
+
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        img.save_cuts(out_dir, raw=raw)
+        return [cut.filename for cut in img.cuts]
+    finally:
+        img.cuts = []
+        img.release_scratch()
+        if scratch is not None:
+            scratch.close()
+
+
+def read_manifest(manifest):
+    '''
+    list of study dicts from a JSON manifest: a list of {"file": ..., and any of "cutter", "nmice",
+    "cx", "cy", "rotations"}; relative file paths are taken relative to the manifest
+    '''
+    with open(manifest, 'r') as f:
+        studies = json.load(f)
+    base = os.path.dirname(os.path.abspath(manifest))
+    for study in studies:
+        if 'file' not in study:
+            raise ValueError('Manifest entry without "file": {}'.format(study))
+        study['file'] = os.path.join(base, study['file'])
+    return studies
+
+
+def folder_studies(folder):
+    '''
+    one study dict per PET/CT image under folder
+    '''
+    return [{'file' : f} for f,cls in sorted(find_images(folder))]
+
+
+def study_kwargs(study, settings):
+    kwargs = dict(settings)
+    kwargs.update({k:v for k,v in study.items() if k != 'file'})
+    return kwargs
+
+
+def cut_study_worker(filepath, out_dir, kwargs):
+    '''
+    cut_study for a worker process; returns (saved filenames, None) or (None, traceback text) so
+    that a failing study never takes down the pool
+    '''
+    try:
+        return cut_study(filepath, out_dir, **kwargs), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def run_batch(studies, out_dir, defaults=None, raw=True, workers=1, memory_budget=None, scratch_root=None):
+    '''
+    cuts the studies, one at a time or on a pool of worker processes; settings missing from a
+    study come from defaults, then STUDY_DEFAULTS; a failing study is reported and skipped (also
+when it kills its worker process: the other studies of the broken pool are run again);
+    memory_budget (bytes per worker) bounds the read/write blocks each worker streams through
+    (a quarter of the budget, leaving room for the scaled/cast copies of a block) and, with
+    raw=False, the buffers it keeps in RAM (up to half the budget, larger ones go to scratch); scratch_root
+    is where raw=False keeps the temp memmaps too big for RAM; returns {file : list of saved filenames, or the exception}
+    '''
+    settings = dict(STUDY_DEFAULTS)
+    settings.update(defaults or {})
+    settings['raw'] = raw
+    if scratch_root is not None:
+        settings['scratch_root'] = scratch_root
+    if memory_budget is not None:
+        settings['data_lim'] = max(1, int(memory_budget/4))
+        if not raw:
+            settings['ram_threshold'] = int(memory_budget/2)
+
+    results = {}
+    n = len(studies)
+    if workers <= 1:
+        for i,study in enumerate(studies):
+            print('[{0}/{1}] {2}'.format(i+1, n, study['file']))
+            try:
+                results[study['file']] = cut_study(study['file'], out_dir, **study_kwargs(study, settings))
+            except Exception as e:
+                traceback.print_exc()
+                print('Failed to cut {0}: {1}'.format(study['file'], e))
+                results[study['file']] = e
+        return results
+
+    def report(i, filepath, saved, error):
+        if error is None:
+            results[filepath] = saved
+            print('[{0}/{1}] Cut {2} into {3} files.'.format(i+1, n, filepath, len(saved)))
+        else:
+            results[filepath] = RuntimeError(error)
+            print('[{0}/{1}] Failed to cut {2}:\n{3}'.format(i+1, n, filepath, error))
+
+    # a worker that dies breaks the whole pool, failing every study still queued on it; those
+    # are retried each in a pool of its own so that only the study that kills its worker fails
+    retry = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(cut_study_worker, study['file'], out_dir, study_kwargs(study, settings)) : study
+                    for study in studies}
+        for future in as_completed(futures):
+            try:
+                saved, error = future.result()
+            except BrokenProcessPool:
+                retry.append(futures[future])
+                continue
+            report(len(results), futures[future]['file'], saved, error)
+
+    if retry:
+        print('A worker process died; retrying {} unfinished studies one per process.'.format(len(retry)))
+    for start in range(0, len(retry), workers):
+        isolated = []
+        for study in retry[start:start+workers]:
+            pool = ProcessPoolExecutor(max_workers=1)
+            isolated.append((study, pool, pool.submit(cut_study_worker, study['file'], out_dir, study_kwargs(study, settings))))
+        for study,pool,future in isolated:
+            try:
+                saved, error = future.result()
+            except BrokenProcessPool as e:
+                saved, error = None, 'Worker process died (e.g. out of memory): {}'.format(e)
+            pool.shutdown()
+            report(len(results), study['file'], saved, error)
+    return results
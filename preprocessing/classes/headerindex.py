@@ -0,0 +1,108 @@
+import os
+import json
+import tempfile
+import threading
+import numpy as np
+
+
+class HeaderIndex:
+    '''
+    On-disk index of parsed header parameters so folder scans only parse new or changed headers.
+    Entries are keyed by absolute header path and are only used while the header's size and
+    mtime still match.
+    '''
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.Lock()  # images may be opened from scan threads
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r') as f:
+                self.entries = json.load(f)
+        except (ValueError, OSError) as e:
+            print('Ignoring unreadable header index {0}: {1}'.format(self.index_file, e))
+            self.entries = {}
+
+    def save(self):
+        '''
+        writes the index if it changed; a folder that is missing or read-only only costs the
+        cache, the entries stay in memory
+        '''
+        with self.lock:
+            if not self.changed:
+                return
+            tmp_file = None
+            try:
+                # per-process temp name, several instances may share a data folder
+                fd,tmp_file = tempfile.mkstemp(prefix=os.path.basename(self.index_file)+'.',
+                                               suffix='.tmp', dir=os.path.dirname(self.index_file) or '.')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp_file, self.index_file)
+            except OSError as e:
+                print('Failed to save header index {0}: {1}'.format(self.index_file, e))
+                if tmp_file is not None and os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                return
+            self.changed = False
+
+    def get_stat(self, header_file):
+        st = os.stat(header_file)
+        return [st.st_size, st.st_mtime_ns]
+
+    def get(self, header_file):
+        '''
+        returns the cached entry for header_file, or None if missing or stale
+        '''
+        entry = self.entries.get(os.path.abspath(header_file))
+        if entry is None or entry['stat'] != self.get_stat(header_file):
+            return None
+        return entry
+
+    def put(self, img):
+        params = {k : (v.tolist() if isinstance(v, np.ndarray) else v) for k,v in img.params._asdict().items()}
+        entry = {
+            'stat' : self.get_stat(img.header_file),
+            'params' : params
+        }
+        with self.lock:
+            self.entries[os.path.abspath(img.header_file)] = entry
+            self.changed = True
+
+    def update(self, img):
+        '''
+        records img's params if its entry is missing or stale
+        '''
+        if self.get(img.header_file) is None:
+            self.put(img)
+
+    def prune(self, header_files):
+        '''
+        drops entries for headers not in header_files (e.g. studies removed from the folder)
+        '''
+        keep = set(os.path.abspath(f) for f in header_files)
+        with self.lock:
+            for key in [k for k in self.entries if k not in keep]:
+                del self.entries[key]
+                self.changed = True
+
+    def open_image(self, filepath, image_class, lazy=False):
+        '''
+        image_class(filepath) using cached header params when they are still valid;
+        otherwise parses the header and records it, or with lazy=True leaves the header
+        unparsed (record it later with self.put once it has been used)
+        '''
+        entry = self.get(filepath+'.hdr')
+        if entry is not None:
+            return image_class(filepath, params=entry['params'])
+        if lazy:
+            return image_class(filepath, lazy=True)
+        img = image_class(filepath)
+        self.put(img)
+        return img
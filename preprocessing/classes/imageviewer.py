@@ -7,7 +7,7 @@ from .baseimage import PETImage, SubImage
 
 class ImageViewer:
 
-	def __init__(self, image=None, collapse='max', escale=1.0, interval=100):
+	def __init__(self, image=None, collapse='max', escale=1.0, interval=100, display_size=512):
 		self.image = image    # data_handler.MyImage superclass
 
 		# toggle for animation
@@ -16,6 +16,7 @@ class ImageViewer:
 		# cut coords (only used in ImageEditor)
 		self.cx_def,self.cy_def = int(round(self.image.xdim/2)),int(round(self.image.ydim/2))
 		self.cx,self.cy = self.cx_def,self.cy_def
+		self.cut_placed = False	# set once the user clicks a position; auto placement then leaves it alone
 
 		# scaling to use when displaying images
 		self.escale = escale
@@ -25,6 +26,9 @@ class ImageViewer:
 
 		self.interval = interval
 
+		# largest side (pixels) of rendered animation frames
+		self.display_size = display_size
+
 	def is_x(self,ax):
 		return [k for k,v in self.image.ax_map.items() if v==ax][0]=='x'
 
@@ -40,6 +44,49 @@ class ImageViewer:
 	def stop_animation(self):
 		plt.close()
 
+	def display_level(self, shape):
+		'''
+		smallest power of 2 reduction (see BaseImage.pyramid) fitting shape[:2] in display_size
+		'''
+		k = 1
+		while max(shape[:2]) > k*self.display_size:
+			k *= 2
+		return k
+
+	def projection_shape(self, axis, image=None):
+		'''
+		full resolution (rows,cols) of the displayed projection on axis (x projections are swapped)
+		'''
+		image = self.image if image is None else image
+		shape = image.project(axis,self.collapse).shape[:2]
+		return shape[::-1] if self.is_x(image.get_axis(axis)) else shape
+
+	def render(self, mats, k=None):
+		'''
+		renders display frames once into a contiguous uint8 (frames,rows,cols) buffer, so that
+		animations only swap precomputed images: [0,1] intensities map to 0..255; frames already
+		reduced k times (pyramid levels) are only converted, full resolution frames (k=None) are
+		block-max downsampled so that no side exceeds display_size; returns (buffer, extent),
+		extent keeping the axes in full resolution pixel coordinates
+		'''
+		by,bx = mats[0].shape
+		downsample = k is None
+		if downsample:
+			k = max(1, int(np.ceil(max(by,bx)/float(self.display_size))))
+			ny,nx = -(-by//k), -(-bx//k)
+		else:
+			ny,nx = by,bx
+		buf = np.empty((len(mats),ny,nx), dtype=np.uint8)
+		for i,mat in enumerate(mats):
+			if downsample and k > 1:
+				mat = np.pad(mat, ((0,ny*k-by),(0,nx*k-bx)), mode='edge')
+				mat = mat.reshape(ny,k,nx,k).max(axis=(1,3))
+			buf[i] = np.clip(mat*255, 0, 255)
+		return buf, (-0.5, nx*k-0.5, ny*k-0.5, -0.5)
+
+	def show_frame(self, ax, buf, extent):
+		return ax.imshow(buf[0], cmap='gray', clim=(0,255), extent=extent, interpolation='nearest', animated=True)
+
 
 	def connect_controls(self,fig,cutter=False):
 		
@@ -53,6 +100,7 @@ class ImageViewer:
 		def onClick(event):
 			if event.xdata is not None and event.ydata is not None:
 				self.cx,self.cy = (int(round(event.xdata)),int(round(event.ydata)))
+				self.cut_placed = True
 				if self.nmice > 2:
 					message = 'Cutter coords: (x={0},y={1})'.format(self.cx,self.cy)
 				else:
@@ -65,17 +113,22 @@ class ImageViewer:
 
 	def view_each_axis(self, frame_range=None):
 		if frame_range is None:
-			# collapse over frames using sum or max
-			frame = self.image.collapse_over_frames(method=self.collapse)
+			# collapse cached projections over frames using sum or max
+			collapse_frames = lambda ax: getattr(self.image.project(ax,self.collapse),self.collapse)(axis=-1)
+			xmat = collapse_frames('x').swapaxes(0,1)
+			ymat = collapse_frames('y')
+			zmat = collapse_frames('z')
 		else:
 			fs = range(frame_range[0],frame_range[1]+1)
 			frames = np.stack([self.image.get_frame(k) for k in fs],axis=-1)
 			frame = self.image.collapse_over_frames(method=self.collapse,matrix=frames)
 		
-		# collapse and scale frame
-		xmat = getattr(frame,self.collapse)(axis=self.image.get_axis('x')).swapaxes(0,1)
-		ymat = getattr(frame,self.collapse)(axis=self.image.get_axis('y'))
-		zmat = getattr(frame,self.collapse)(axis=self.image.get_axis('z'))
+			# collapse frame
+			xmat = getattr(frame,self.collapse)(axis=self.image.get_axis('x')).swapaxes(0,1)
+			ymat = getattr(frame,self.collapse)(axis=self.image.get_axis('y'))
+			zmat = getattr(frame,self.collapse)(axis=self.image.get_axis('z'))
+
+		# scale
 		xmat = xmat*(self.escale/xmat.max())
 		ymat = ymat*(self.escale/ymat.max())
 		zmat = zmat*(self.escale/zmat.max())
@@ -97,7 +150,7 @@ class ImageViewer:
 	def animate_slice(self,view_ax,slice_ix, get_mats=False):
 		self.check_frames()
 		view_ax = self.image.get_axis(view_ax)
-		frames = np.take(self.image.img_data, slice_ix, view_ax)
+		frames = np.take(self.image.oriented_data(), slice_ix, view_ax)
 		frames = self.escale*frames/frames.max()
 		frames = self.image.split_on_axis(frames,2)
 		if self.is_x(view_ax):
@@ -108,26 +161,35 @@ class ImageViewer:
 		else:
 			self.do_animation(frames)
 
-	def animate_collapse(self,view_ax, get_mats=False):
+	def animate_collapse(self,view_ax, get_mats=False, k=None):
+		'''
+		animates the projection on view_ax over frames, at pyramid level k (the display level
+		by default; full resolution for get_mats unless k is given)
+		'''
 		self.check_frames()
 		view_ax = self.image.get_axis(view_ax)
-		f1,f2 = self.image.frame_range
-		mats = [self.image.collapse_frame(axis=view_ax,frame=ix,method=self.collapse) for ix in range(f1,f2+1)]
-		scale = self.escale/np.array(mats).max()
-		mats = [m*scale for m in mats]
+		shape = self.projection_shape(view_ax)
+		if k is None:
+			k = 1 if get_mats else self.display_level(shape)
+		block = self.image.pyramid(view_ax,self.collapse,k)
+		scale = self.escale/block.max()
+		mats = self.image.split_on_axis(block*scale,2)
 		if self.is_x(view_ax):
 			mats = self.swap_x(mats)
-		
-		mats.reverse()
 
 		if get_mats:
 			return mats
 		else:
-			self.do_animation(mats)
+			self.do_animation(mats, k=k, shape=shape)
 
 	def animate_along_axis(self,axis,frame=None, get_mats=False):
+		'''
+		animates the slices of one frame along axis; on an image that was not loaded the frame is
+		read through image.window, so single frames of a long dynamic study can be browsed
+		without load_image
+		'''
 		if frame is None:
-			frame = self.image.frame_range[0]
+			frame = self.image.frame_range[0] if self.image.frame_range is not None else 0
 		frame_mat = self.image.get_frame(frame)
 		scale = self.escale/frame_mat.max()
 		frame_mat = frame_mat*scale
@@ -139,7 +201,10 @@ class ImageViewer:
 			self.do_animation(mats)
 
 
-	def do_animation(self,frames):
+	def do_animation(self,frames,k=None,shape=None):
+		'''
+		animates frames; frames reduced k times need the full resolution shape for the axes
+		'''
 		
 		def genIx():
 			dt = 1
@@ -150,7 +215,7 @@ class ImageViewer:
 				yield t
 
 		def genAni(k):
-			img.set_array(frames[k])
+			img.set_array(buf[k])
 			return patches
 
 		# prevents error in matplotlib.animation if only one image
@@ -159,11 +224,12 @@ class ImageViewer:
 
 		self.pause = False
 
-		by, bx = frames[0].shape
+		by, bx = frames[0].shape if shape is None else shape
+		buf,extent = self.render(frames, k)
 		fig = plt.figure()
 
 		ax = fig.add_subplot(111)
-		img = ax.imshow(frames[0], cmap='gray', clim=(0,1), animated=True)
+		img = self.show_frame(ax, buf, extent)
 		patches=[img]
 		ax.set_xlim(0, bx)
 		ax.set_ylim(0, by)
@@ -184,18 +250,21 @@ class ImageViewer:
 				yield t
 
 		def genAni(k):
-			imgs[0].set_array(xmats[k])
-			imgs[1].set_array(ymats[k])
-			imgs[2].set_array(zmats[k])
+			imgs[0].set_array(bufs[0][k])
+			imgs[1].set_array(bufs[1][k])
+			imgs[2].set_array(bufs[2][k])
 			return imgs
 
 
 		# prevents error in matplotlib.animation if only one image
 		img_data = self.image.img_data
 		nframes = img_data.shape[-1]
-		xblock = getattr(img_data,self.collapse)(axis=self.image.get_axis('x'))
-		yblock = getattr(img_data,self.collapse)(axis=self.image.get_axis('y'))
-		zblock = getattr(img_data,self.collapse)(axis=self.image.get_axis('z'))
+		self.image.project_all(self.collapse)
+
+		# display level of each projection
+		shapes = [self.projection_shape(ax) for ax in ['x','y','z']]
+		ks = [self.display_level(shape) for shape in shapes]
+		xblock,yblock,zblock = [self.image.pyramid(ax,self.collapse,k) for ax,k in zip(['x','y','z'],ks)]
 		
 		# normalize blocks
 		xblock = (self.escale/xblock.max())*xblock
@@ -226,16 +295,16 @@ class ImageViewer:
 		ax2 = plt.subplot(122)
 		ax3 = plt.subplot(223)
 		plt.tight_layout()
-		imgs = [ax1.imshow(xmats[0], cmap='gray', clim=(0,1), animated=True),
-				ax2.imshow(ymats[0], cmap='gray', clim=(0,1), animated=True),
-				ax3.imshow(zmats[0], cmap='gray', clim=(0,1), animated=True)]
+		rendered = [self.render(mats,k) for mats,k in zip([xmats,ymats,zmats],ks)]
+		bufs = [buf for buf,extent in rendered]
+		imgs = [self.show_frame(ax, buf, extent) for ax,(buf,extent) in zip([ax1,ax2,ax3],rendered)]
 
 		ax_title = {0:'x axis', 1:'y axis', 2:'z axis'}
-		pairs = [(ax1,xmats[0]),(ax2,ymats[0]),(ax3,zmats[0])]
+		pairs = [(ax1,shapes[0]),(ax2,shapes[1]),(ax3,shapes[2])]
 		for j,pair in enumerate(pairs):
-			ax,mat = pair
-			ax.set_xlim(0,mat.shape[1])
-			ax.set_ylim(0,mat.shape[0])
+			ax,shape = pair
+			ax.set_xlim(0,shape[1])
+			ax.set_ylim(0,shape[0])
 			ax.set_title(ax_title[j])
 
 		self.connect_controls(fig)
@@ -271,6 +340,141 @@ class ImageEditor(ImageViewer):
 		if self.nmice not in range(1,5):
 			raise ValueError('ImageEditor.nmice not properly initialized.')
 
+	def find_valley(self, profile):
+		'''
+		index of the minimum of the smoothed profile within its middle half; on a flat gap the
+		centre of the longest minimal run, furthest from the animals on either side
+		'''
+		n = len(profile)
+		w = max(1, n//20)
+		smooth = np.convolve(profile, np.ones(w)/w, mode='same')
+		lo, hi = n//4, max(n//4+1, (3*n)//4)
+		seg = smooth[lo:hi]
+		low = seg <= seg.min() + 1e-3*(seg.max()-seg.min())
+		edges = np.flatnonzero(np.diff(np.concatenate(([0], low.astype(int), [0]))))
+		starts,stops = edges[::2],edges[1::2]
+		i = int(np.argmax(stops-starts))
+		return lo + int((starts[i]+stops[i]-1)//2)
+
+	def scaled_frames(self, proj):
+		'''
+		proj (...,frames) with each frame's scale_factor applied if the image holds raw values
+		(mapped and unscaled), so that frames compare on one scale; else proj itself
+		'''
+		if self.image.scaled is False:
+			return proj*np.atleast_1d(self.image.scale_factor).astype(np.float32)
+		return proj
+
+	def auto_cut_points(self, cutter=None):
+		'''
+		proposes (cx,cy) for cutter from the (cached) z-axis projection, collapsed over frames
+		with self.collapse: the lowest activity valley between animals along x and y; for T
+		cutters cx comes from the half that is split in two; coordinates not used by cutter stay
+		at the image centre
+		'''
+		if cutter is None:
+			cutter = self.cutter
+		proj = self.scaled_frames(self.image.project('z',self.collapse))
+		plane = getattr(proj,self.collapse)(axis=-1)	# (y,x)
+		cx,cy = self.cx_def,self.cy_def
+		if cutter in ['cross','up_T','down_T','horizontal']:
+			cy = self.find_valley(plane.sum(axis=1))
+		if cutter == 'up_T':
+			rows = plane[cy:]
+		elif cutter == 'down_T':
+			rows = plane[:cy]
+		else:
+			rows = plane
+		if rows.shape[0] == 0:
+			rows = plane
+		if cutter in ['cross','up_T','down_T','vertical']:
+			cx = self.find_valley(rows.sum(axis=0))
+		return cx,cy
+
+	def auto_cut(self, keep_placed=False):
+		'''
+		moves the cutter to auto_cut_points; with keep_placed=True a position the user clicked is kept
+		'''
+		if keep_placed and self.cut_placed:
+			return
+		self.cx,self.cy = self.auto_cut_points()
+		self.cut_placed = False
+
+	def label_blobs(self, mask):
+		'''
+		labels the 4-connected components of a boolean mask by propagating the largest
+		neighbouring label until nothing changes; returns (labels, areas) with 0 as background
+		'''
+		labels = np.where(mask, np.arange(1, mask.size+1).reshape(mask.shape), 0)
+		while True:
+			padded = np.pad(labels, 1, mode='constant')
+			grown = np.maximum.reduce([labels,
+				padded[:-2,1:-1], padded[2:,1:-1],
+				padded[1:-1,:-2], padded[1:-1,2:]])
+			grown = np.where(mask, grown, 0)
+			if np.array_equal(grown, labels):
+				break
+			labels = grown
+		ids,labels = np.unique(labels, return_inverse=True)
+		labels = labels.reshape(mask.shape)
+		if ids[0] != 0:
+			labels += 1
+		areas = np.bincount(labels.ravel())[1:]
+		return labels,areas
+
+	def detect_mice(self, threshold=0.05, min_area=0.1, max_size=64):
+		'''
+		proposes (nmice, cutter) from the max z-axis projection: its pyramid level of at most
+		max_size pixels a side (frames scaled first for unscaled images), max over frames,
+		thresholded at threshold of the activity range and dilated by a pixel to join nearby
+		hot spots of the same animal; components under min_area of the
+		largest are ignored; 2 animals are split along their larger centroid separation and 3
+		animals with the T that puts two of them in the same half
+		'''
+		shape = self.image.project('z','max').shape[:2]
+		k = 1
+		while max(shape) > k*max_size:
+			k *= 2
+		plane = self.scaled_frames(self.image.pyramid('z','max',k)).max(axis=-1)	# (y,x)
+		lo,hi = plane.min(),plane.max()
+		if hi <= lo:
+			return 1,'no_cut'
+		mask = plane > lo + threshold*(hi-lo)
+		padded = np.pad(mask, 1, mode='constant')
+		mask = mask | padded[:-2,1:-1] | padded[2:,1:-1] | padded[1:-1,:-2] | padded[1:-1,2:]
+
+		labels,areas = self.label_blobs(mask)
+		keep = np.flatnonzero(areas >= min_area*areas.max()) + 1
+		nmice = int(min(len(keep), 4))
+		if nmice <= 1:
+			return 1,'no_cut'
+		if nmice == 4:
+			return 4,'cross'
+
+		yy,xx = np.indices(plane.shape)
+		flat = labels.ravel()
+		counts = np.bincount(flat)[keep]
+		cy = np.bincount(flat, yy.ravel())[keep]/counts
+		cx = np.bincount(flat, xx.ravel())[keep]/counts
+		if nmice == 2:
+			if abs(cx[0]-cx[1]) >= abs(cy[0]-cy[1]):
+				return 2,'vertical'
+			return 2,'horizontal'
+		# 3 animals: the two with nearest y share the half split by the T
+		cy = np.sort(cy)
+		if cy[1]-cy[0] > cy[2]-cy[1]:
+			return 3,'up_T'
+		return 3,'down_T'
+
+	def auto_detect(self):
+		'''
+		sets nmice and cutter from detect_mice; returns them
+		'''
+		self.nmice,cutter = self.detect_mice()
+		if cutter != 'no_cut':
+			self.cutter = cutter
+		return self.nmice,cutter
+
 
 
 	def animated_cutter(self, view_ax='z', cutter=None, method='collapse', frame_range=None, slice_ix=None):
@@ -306,7 +510,7 @@ class ImageEditor(ImageViewer):
 			else:
 				raise ValueError('Unexpected cutter in animated_cutter: {}'.format(self.cutter))
 
-			img.set_array(mats[k])
+			img.set_array(buf[k])
 			return patches
 
 		if cutter is None:
@@ -325,8 +529,12 @@ class ImageEditor(ImageViewer):
 		if frame_range is None:
 			frame_range = self.image.frame_range
 
+		# pyramid level of the collapsed view; other methods are downsampled by render
+		k = None
 		if method == 'collapse':	# add frame_range info
-			mats = self.animate_collapse(view_ax=view_ax, get_mats=True)
+			shape = self.projection_shape(view_ax)
+			k = self.display_level(shape)
+			mats = self.animate_collapse(view_ax=view_ax, get_mats=True, k=k)
 		elif method == 'slice':		# add frame_range info
 			if slice_ix is None:
 				print('No slice index indicated. Using 0.')
@@ -344,7 +552,7 @@ class ImageEditor(ImageViewer):
 		self.pause = False
 		nlines = self.line_map[self.cutter]
 		view_ax = self.image.get_axis(view_ax)
-		by,bx = mats[0].shape
+		by,bx = mats[0].shape if k is None else shape
 
 		if self.cutter in ['up_T','down_T','cross'] and view_ax !=0:
 			raise ValueError('Must use {} cutter in z-axis view.'.format(self.cutter))
@@ -353,10 +561,11 @@ class ImageEditor(ImageViewer):
 		if view_ax == 2:
 			raise ValueError('Cannot cut images in x-axis view.')
 
+		buf,extent = self.render(mats, k)
 		fig = plt.figure()
 
 		ax = fig.add_subplot(111)
-		img = ax.imshow(mats[0], cmap='gray', clim=(0,1), animated=True)
+		img = self.show_frame(ax, buf, extent)
 		lines = [ax.plot([],[],'r-')[0] for _ in range(nlines)]
 		patches = [img] + lines
 		ax.set_xlim(0, bx)
@@ -374,97 +583,27 @@ class ImageEditor(ImageViewer):
 
 		self.image.clean_cuts()
 		cx,cy = self.cx,self.cy
-		img_data = self.image.img_data
-
-		# cut in half in y,z plane
-		if self.cutter == 'vertical':
-
-			# left half
-			lhfn, lhd = self.image.submemmap(ix=1, data=img_data[:,:,:cx,:])
-			left_im = SubImage(parent_image=self.image, img_data=lhd, filename=lhfn)
-			
-			# right half
-			rhfn, rhd = self.image.submemmap(ix=2, data=img_data[:,:,cx:,:])
-			right_im = SubImage(parent_image=self.image, img_data=rhd, filename=rhfn)
-			
-			self.image.cuts = [left_im, right_im]
-			return self.image.cuts
-
-		elif self.cutter == 'horizontal':
-
-			# top half
-			thfn, thd = self.image.submemmap(ix=1, data=img_data[:,cy:,:,:])
-			top_im = SubImage(parent_image=self.image, img_data=thd, filename=thfn)
 
-			# bottom half
-			bhfn, bhd = self.image.submemmap(ix=2, data=img_data[:,:cy,:,:])
-			bottom_im = SubImage(parent_image=self.image, img_data=bhd, filename=bhfn)
-			
-			self.image.cuts = [top_im, bottom_im]
-			return self.image.cuts
-
-		elif self.cutter == 'down_T':
-
-			# top half
-			thfn, thd = self.image.submemmap(ix=1, data=img_data[:,cy:,:,:])
-			top_im = SubImage(parent_image=self.image, img_data=thd, filename=thfn)
-
-			# bottom left
-			blfn, bld = self.image.submemmap(ix=2, data=img_data[:,:cy,:cx,:])
-			bl = SubImage(parent_image=self.image, img_data=bld, filename=blfn)
-
-			# bottom right
-			brfn, brd = self.image.submemmap(ix=3, data=img_data[:,:cy,cx:,:])
-			br = SubImage(parent_image=self.image, img_data=brd,  filename=brfn)
-			
-			self.image.cuts = [top_im, bl, br]
-			return self.image.cuts
-
-
-		elif self.cutter == 'up_T':
-
-			# top left
-			tlfn, tld = self.image.submemmap(ix=1, data=img_data[:,cy:,:cx,:])
-			tl = SubImage(parent_image=self.image, img_data=tld, filename=tlfn)
-
-
-			# top right
-			trfn, trd = self.image.submemmap(ix=2, data=img_data[:,cy:,cx:,:])
-			tr = SubImage(parent_image=self.image, img_data=trd, filename=trfn)
-
-			# bottom half
-			bhfn, bhd = self.image.submemmap(ix=3, data=img_data[:,:cy,:,:])
-			bottom_im = SubImage(parent_image=self.image, img_data=bhd, filename=bhfn)
-
-			self.image.cuts = [tl, tr, bottom_im]
-			return self.image.cuts
-
-		# cut in quadrants in y,z and x,z planes
-		elif self.cutter == 'cross':
-
-			# top left
-			tlfn, tld = self.image.submemmap(ix=1, data=img_data[:,cy:,:cx,:])
-			tl = SubImage(parent_image=self.image, img_data=tld, filename=tlfn)
-
-			# top right
-			trfn, trd = self.image.submemmap(ix=2, data=img_data[:,cy:,cx:,:])
-			tr = SubImage(parent_image=self.image, img_data=trd, filename=trfn)
-			
-			# bottom left
-			blfn, bld = self.image.submemmap(ix=3, data=img_data[:,:cy,:cx,:])
-			bl = SubImage(parent_image=self.image, img_data=bld, filename=blfn)
-
-			# bottom right
-			brfn, brd = self.image.submemmap(ix=4, data=img_data[:,:cy,cx:,:])
-			br = SubImage(parent_image=self.image, img_data=brd,  filename=brfn)
-
-
-			self.image.cuts = [tl,tr,bl,br]
-
-			return self.image.cuts
-		else:
+		# (z,y,x) regions of each cut; cuts are views of the image data
+		regions = {
+			# cut in half in y,z plane: left half, right half
+			'vertical' : [np.s_[:,:,:cx], np.s_[:,:,cx:]],
+			# top half, bottom half
+			'horizontal' : [np.s_[:,cy:,:], np.s_[:,:cy,:]],
+			# top half, bottom left, bottom right
+			'down_T' : [np.s_[:,cy:,:], np.s_[:,:cy,:cx], np.s_[:,:cy,cx:]],
+			# top left, top right, bottom half
+			'up_T' : [np.s_[:,cy:,:cx], np.s_[:,cy:,cx:], np.s_[:,:cy,:]],
+			# cut in quadrants in y,z and x,z planes: top left, top right, bottom left, bottom right
+			'cross' : [np.s_[:,cy:,:cx], np.s_[:,cy:,cx:], np.s_[:,:cy,:cx], np.s_[:,:cy,cx:]]
+		}
+		if self.cutter not in regions:
 			raise ValueError('ImageEditor with cutter = {} calling self.cut_image()'.format(self.cutter))
 
+		self.image.cuts = [SubImage(parent_image=self.image, region=region, filename=self.image.cut_filename(ix=i+1))
+							for i,region in enumerate(regions[self.cutter])]
+		return self.image.cuts
+
 
 	def animate_cuts(self, view_ax='z'):
 		
@@ -477,9 +616,9 @@ class ImageEditor(ImageViewer):
 				yield t
 
 		def genAni(k):
-			f_img[0].set_array(fmats[k])
+			f_img[0].set_array(fbuf[k])
 			for j,im in enumerate(imgs):
-				im.set_array(cuts[j][k])
+				im.set_array(cut_bufs[j][0][k])
 			return all_imgs
 
 		self.check_nmice()
@@ -490,20 +629,21 @@ class ImageEditor(ImageViewer):
 		# for splitting collapsed data into frames
 		split_frames = lambda x: self.image.split_on_axis(x,2)
 		
-		fdata = self.image.img_data
 		axis = self.image.get_axis(view_ax)
-		fdata = getattr(fdata,self.collapse)(axis=axis)
+		fshape = self.projection_shape(axis)
+		k = self.display_level(fshape)
+		fdata = self.image.pyramid(axis,self.collapse,k)
 		scale = self.escale/fdata.max()
 		fdata = fdata*scale
 		fmats = split_frames(fdata)
 		nframes = len(fmats)
 
 		cuts = self.image.cuts
-		cuts = [cut.img_data for cut in cuts]
 		ncuts = len(cuts)
 		
 
-		cuts = [getattr(img_data,self.collapse)(axis=axis)*scale for img_data in cuts]
+		shapes = [self.projection_shape(axis,cut) for cut in cuts]
+		cuts = [cut.pyramid(axis,self.collapse,k)*scale for cut in cuts]
 		cuts = [split_frames(img_data) for img_data in cuts]
 		
 		if len(fmats) == 1:
@@ -517,7 +657,7 @@ class ImageEditor(ImageViewer):
 
 		# plotting
 		fig = plt.figure()
-		shapes = [cl[0].shape for cl in cuts]	# for grid formatting
+		# full resolution shapes for grid formatting and limits
 		
 		if self.cutter == 'vertical':
 			w1,w2 = shapes[0][1],shapes[1][1]
@@ -597,12 +737,14 @@ class ImageEditor(ImageViewer):
 		for i,p in enumerate(pairs):
 			ax,cl = p
 			ax.set_title('New SubImage ({})'.format(i+1))
-			by,bx = cl[0].shape
+			by,bx = shapes[i]
 			ax.set_xlim(0,bx),ax.set_ylim(0,by)
-		by,bx = fmats[0].shape
+		by,bx = fshape
 		full_ax.set_xlim(0,bx), full_ax.set_ylim(0,by)
-		imgs = [p[0].imshow(p[1][0], cmap='gray', clim=(0,1), animated=True) for p in pairs]
-		f_img = [full_ax.imshow(fmats[0], cmap='gray', clim=(0,1), animated=True)]
+		cut_bufs = [self.render(cl,k) for cl in cuts]
+		fbuf,fextent = self.render(fmats,k)
+		imgs = [self.show_frame(p[0], *cut_bufs[j]) for j,p in enumerate(pairs)]
+		f_img = [self.show_frame(full_ax, fbuf, fextent)]
 		all_imgs = f_img + imgs
 		
 		self.connect_controls(fig)
@@ -0,0 +1,128 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .baseimage import LoadCancelled
+
+
+class PrefetchEntry:
+
+    def __init__(self, img, nbytes):
+        self.img = img
+        self.nbytes = nbytes
+        self.cancel = threading.Event()
+        self.future = None
+        self.progress = None  # forwarded callback of whoever took the entry, see Prefetcher.take
+        self.read = None      # latest (bytes_read, total_bytes)
+
+    def hook(self, done, total):
+        '''
+        progress hook of the background load
+        '''
+        self.read = (done, total)
+        progress = self.progress
+        if progress is not None and progress(done, total) is False:
+            self.cancel.set()
+        return not self.cancel.is_set()
+
+
+class Prefetcher:
+    '''
+    Loads studies ahead of time on a background thread into a bounded cache, so that opening the
+    next study only has to wait for whatever is left of its read. Entries are keyed by absolute
+    image path; the cache holds at most budget bytes of loaded (float32) data, evicting the oldest
+    entries first, and dropped entries are cancelled and their scratch buffers released.
+    '''
+
+    def __init__(self, budget=2*10**9, scratch=None):
+        self.budget = budget
+        self.scratch = scratch              # ScratchManager or StoragePolicy the loads allocate from
+        self.entries = OrderedDict()        # path -> PrefetchEntry
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+    def key(self, img):
+        return os.path.abspath(img.filepath)
+
+    def load_size(self, img):
+        '''
+        bytes of the scaled float32 data load_image writes for img
+        '''
+        ps = img.params
+        return 4*ps.x_dimension*ps.y_dimension*ps.z_dimension*ps.total_frames
+
+    def used(self):
+        return sum(entry.nbytes for entry in self.entries.values())
+
+    def prefetch(self, img):
+        '''
+        starts loading img unless it is cached already or does not fit in the budget
+        '''
+        key = self.key(img)
+        with self.lock:
+            if key in self.entries:
+                return
+            try:
+                nbytes = self.load_size(img)  # parses a lazy image's header
+            except (ValueError, OSError) as e:
+                print('Not prefetching {0}: {1}'.format(img.filename, e))
+                return
+            if nbytes > self.budget:
+                return
+            while self.entries and self.used()+nbytes > self.budget:
+                self.release(self.entries.popitem(last=False)[1])
+            entry = self.entries[key] = PrefetchEntry(img, nbytes)
+            img.scratch = self.scratch
+            entry.future = self.pool.submit(img.load_image, progress=entry.hook)
+        print('Prefetching {}'.format(img.filename))
+
+    def take(self, img, progress=None):
+        '''
+        removes img's entry from the cache; returns its loaded image (waiting for the read to
+        finish if needed), or None if img was not prefetched or its load failed; while waiting,
+        the rest of the read is reported to progress (as in load_image), which can cancel it
+        by returning False (LoadCancelled is raised)
+        '''
+        with self.lock:
+            entry = self.entries.pop(self.key(img), None)
+        if entry is None:
+            return None
+        entry.progress = progress
+        read = entry.read
+        if progress is not None and read is not None and progress(*read) is False:
+            entry.cancel.set()
+        try:
+            entry.future.result()
+        except LoadCancelled:
+            entry.img.release_scratch()
+            if progress is None or not entry.cancel.is_set():
+                return None
+            raise LoadCancelled('Loading {} cancelled.'.format(entry.img.filename))
+        except Exception as e:
+            print('Prefetch of {0} failed: {1}'.format(entry.img.filename, e))
+            entry.img.release_scratch()
+            return None
+        return entry.img
+
+    def keep_only(self, imgs):
+        '''
+        drops every cached entry other than those of imgs, e.g. studies the user skipped
+        '''
+        keys = set(self.key(img) for img in imgs)
+        with self.lock:
+            for key in [k for k in self.entries if k not in keys]:
+                self.release(self.entries.pop(key))
+
+    def clear(self):
+        self.keep_only([])
+
+    def shutdown(self):
+        self.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def release(self, entry):
+        '''
+        cancels entry's load; its buffers are released once the load has stopped
+        '''
+        entry.cancel.set()
+        entry.future.add_done_callback(lambda future: entry.img.release_scratch())
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import numpy as np
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+def lock_file(f):
+    '''
+    takes a non-blocking exclusive lock on open file f; False if another process holds it
+    '''
+    try:
+        if os.name == 'nt':
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def open_lease(path):
+    '''
+    opens path for writing; on Windows with delete sharing, so that the open (locked) file can
+    still be renamed
+    '''
+    if os.name != 'nt':
+        return open(path, 'w')
+    import ctypes
+    create_file = ctypes.windll.kernel32.CreateFileW
+    create_file.restype = ctypes.c_void_p
+    # GENERIC_WRITE, share read|write|delete, CREATE_ALWAYS, FILE_ATTRIBUTE_NORMAL
+    handle = create_file(path, 0x40000000, 7, None, 2, 0x80, None)
+    if handle is None or handle == ctypes.c_void_p(-1).value:
+        raise ctypes.WinError()
+    return os.fdopen(msvcrt.open_osfhandle(handle, os.O_WRONLY), 'w')
+
+
+def default_root():
+    '''
+    <system temp dir>/preproc_scratch_<user>, so users of the same host never share a root
+    '''
+    if hasattr(os, 'getuid'):
+        user = str(os.getuid())
+    else:
+        user = os.environ.get('USERNAME', 'user')
+    return os.path.join(tempfile.gettempdir(), 'preproc_scratch_{}'.format(user))
+
+
+def dir_size(directory):
+    total = 0
+    for path,dirs,files in os.walk(directory):
+        for fname in files:
+            try:
+                total += os.path.getsize(os.path.join(path, fname))
+            except OSError:
+                pass
+    return total
+
+
+class ScratchManager:
+    '''
+    Scratch space for temp memmaps. Each session gets its own directory under root, holding a
+    lease file that stays locked for as long as the session lives; sessions whose lease can be
+    locked by someone else (the owner exited or crashed) are swept by the next manager on the
+    same root, so scratch space is never leaked. Memmap files are reference counted; a file
+    whose last reference is released goes back to a pool of idle files (up to pool_limit bytes)
+    that later allocations of a similar size reuse without creating and zero-filling a new one.
+    Allocations beyond quota bytes (live and idle files) are refused.
+    '''
+
+    LEASE = 'lease.json'
+    PREFIX = 'session_'
+    ORPHAN_AGE = 3600  # seconds before a session without lease.json is swept
+
+    def __init__(self, root=None, quota=None, pool_limit=4*10**9):
+        '''
+        root defaults to $PREPROC_SCRATCH, then default_root() (one per user); point it at
+        fast local storage (NVMe, tmpfs) for big images; quota and pool_limit are in bytes
+        (quota None: unlimited; pool_limit 0: no reuse)
+        '''
+        if root is None:
+            root = os.environ.get('PREPROC_SCRATCH') or default_root()
+        self.root = os.path.abspath(root)  # memmaps report absolute filenames
+        self.quota = quota
+        self.pool_limit = pool_limit
+        self.lock = threading.Lock()  # images are loaded from worker threads
+        self.files = {}  # path -> [references, bytes]
+        self.idle = []   # (bytes, path) of released files kept for reuse
+        self.metrics = {
+            'allocations' : 0,
+            'reused' : 0,
+            'releases' : 0,
+            'bytes_in_use' : 0,
+            'idle_bytes' : 0,
+            'peak_bytes' : 0,
+            'swept_sessions' : 0,
+            'swept_bytes' : 0
+        }
+
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root, mode=0o700)
+        self.sweep()
+        self.session = tempfile.mkdtemp(prefix=self.PREFIX, dir=self.root)
+
+        # the lease is locked before it appears under its name, so a concurrent sweep never
+        # finds it unlocked
+        lease_file = os.path.join(self.session, self.LEASE)
+        self.lease = open_lease(lease_file + '.tmp')
+        if not lock_file(self.lease):
+            self.lease.close()
+            shutil.rmtree(self.session, ignore_errors=True)
+            raise OSError('Could not lock the scratch lease in {}.'.format(self.session))
+        json.dump({'pid' : os.getpid(), 'host' : socket.gethostname(), 'started' : time.time()}, self.lease)
+        self.lease.flush()
+        os.replace(lease_file + '.tmp', lease_file)
+
+    def sweep(self):
+        '''
+        removes the session directories under root whose owner is gone
+        '''
+        for item in os.listdir(self.root):
+            directory = os.path.join(self.root, item)
+            if not item.startswith(self.PREFIX) or directory == getattr(self, 'session', None):
+                continue
+            lease_file = os.path.join(directory, self.LEASE)
+            try:
+                if not os.path.exists(lease_file):
+                    # lease still being created, or its owner died before renaming it
+                    if time.time()-os.path.getmtime(directory) < self.ORPHAN_AGE:
+                        continue
+                else:
+                    with open(lease_file, 'a') as lease:
+                        if not lock_file(lease):
+                            continue  # owner still running
+                nbytes = dir_size(directory)
+                shutil.rmtree(directory)
+            except OSError as e:
+                print('Failed to remove scratch session {0}: {1}'.format(directory, e))
+                continue
+            print('Removed stale scratch session: {}'.format(directory))
+            self.metrics['swept_sessions'] += 1
+            self.metrics['swept_bytes'] += nbytes
+
+    def allocate(self, name, shape, dtype='float32', clear=False):
+        '''
+        memmap of shape and dtype in this session, holding one reference; an idle file of at
+        least the size (and at most a quarter larger) is reused as is, so its contents are stale
+        unless clear=True; otherwise a new zero-filled file prefixed with name is created
+        '''
+        nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+        with self.lock:
+            fits = [item for item in self.idle if nbytes <= item[0] <= nbytes*1.25]
+            if fits:
+                item = min(fits)
+                self.idle.remove(item)
+                self.metrics['idle_bytes'] -= item[0]
+                self.metrics['reused'] += 1
+                size,path = item
+            else:
+                # make room by dropping idle files before refusing
+                while self.quota is not None and self.idle and self.used()+nbytes > self.quota:
+                    self.discard(*self.idle.pop(0))
+                if self.quota is not None and self.used()+nbytes > self.quota:
+                    raise ValueError('Scratch quota exceeded: {0} bytes requested, {1} of {2} in use.'.format(
+                        nbytes, self.metrics['bytes_in_use'], self.quota))
+                fd,path = tempfile.mkstemp(prefix='{}_'.format(name), suffix='.dat', dir=self.session)
+                os.close(fd)
+                size = nbytes
+            self.files[path] = [1, size]
+            self.metrics['allocations'] += 1
+            self.metrics['bytes_in_use'] += size
+            self.metrics['peak_bytes'] = max(self.metrics['peak_bytes'], self.metrics['bytes_in_use'])
+        if not fits:
+            return np.memmap(path, mode='w+', dtype=dtype, shape=shape)
+        mmap = np.memmap(path, mode='r+', dtype=dtype, shape=shape)
+        if clear:
+            mmap[:] = 0
+        return mmap
+
+    def used(self):
+        return self.metrics['bytes_in_use'] + self.metrics['idle_bytes']
+
+    def acquire(self, path):
+        with self.lock:
+            self.files[path][0] += 1
+
+    def release(self, path):
+        '''
+        drops a reference to the memmap file at path; with the last one the file goes to the
+        idle pool (oldest idle files are removed to stay within pool_limit), so memmaps of a
+        released file must not be used afterwards
+        '''
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is None:
+                return
+            entry[0] -= 1
+            if entry[0] > 0:
+                return
+            del self.files[path]
+            nbytes = entry[1]
+            self.metrics['releases'] += 1
+            self.metrics['bytes_in_use'] -= nbytes
+            if nbytes > self.pool_limit:
+                self.discard(nbytes, path, idle=False)
+                return
+            self.idle.append((nbytes, path))
+            self.metrics['idle_bytes'] += nbytes
+            while self.metrics['idle_bytes'] > self.pool_limit:
+                self.discard(*self.idle.pop(0))
+
+    def discard(self, nbytes, path, idle=True):
+        '''
+        removes a file no longer referenced (from the idle pool unless idle=False)
+        '''
+        if idle:
+            self.metrics['idle_bytes'] -= nbytes
+        try:
+            os.remove(path)
+        except OSError as e:
+            # still mapped on Windows; removed with the session
+            print('Failed to remove scratch file {0}: {1}'.format(path, e))
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.metrics)
+            stats['files'] = len(self.files)
+            stats['idle_files'] = len(self.idle)
+            stats['quota'] = self.quota
+        return stats
+
+    def close(self):
+        '''
+        removes the whole session; memmaps still in use must not be touched afterwards
+        '''
+        if self.lease is None:
+            return
+        if self.metrics['allocations']:
+            print('Scratch usage: {}'.format(self.stats()))
+        with self.lock:
+            self.files = {}
+            self.idle = []
+            self.metrics['bytes_in_use'] = 0
+            self.metrics['idle_bytes'] = 0
+        self.lease.close()
+        self.lease = None
+        shutil.rmtree(self.session, ignore_errors=True)
@@ -0,0 +1,96 @@
+import os
+import threading
+import numpy as np
+
+
+def available_memory():
+    '''
+    bytes of physical memory available to new allocations, or None if unknown
+    '''
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if os.name == 'nt':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong),
+                        ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong),
+                        ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong),
+                        ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong),
+                        ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class StoragePolicy:
+    '''
+    Backing store for the float buffers of loaded volumes, cut copies and projections: buffers of
+    at most ram_threshold bytes that also fit in ram_fraction of the available memory are plain
+    in-memory arrays, larger ones are memmaps from scratch (a ScratchManager). Has the allocate /
+    release interface of ScratchManager, so either can be set as an image's scratch.
+    '''
+
+    def __init__(self, scratch, ram_threshold=256*10**6, ram_fraction=0.5):
+        self.scratch = scratch
+        self.ram_threshold = ram_threshold
+        self.ram_fraction = ram_fraction
+        self.lock = threading.Lock()
+        self.metrics = {
+            'ram_allocations' : 0,
+            'ram_bytes' : 0,
+            'disk_allocations' : 0,
+            'disk_bytes' : 0
+        }
+
+    def in_memory(self, nbytes):
+        if nbytes > self.ram_threshold:
+            return False
+        avail = available_memory()
+        return avail is None or nbytes <= self.ram_fraction*avail
+
+    def allocate(self, name, shape, dtype='float32', clear=False):
+        '''
+        zero-filled array of shape and dtype in RAM, or a scratch memmap (stale unless clear=True,
+        see ScratchManager.allocate) if it is too big
+        '''
+        nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+        ram = self.in_memory(nbytes)
+        kind = 'ram' if ram else 'disk'
+        with self.lock:
+            self.metrics['{}_allocations'.format(kind)] += 1
+            self.metrics['{}_bytes'.format(kind)] += nbytes
+        if ram:
+            return np.zeros(shape, dtype=dtype)
+        return self.scratch.allocate(name, shape, dtype=dtype, clear=clear)
+
+    def acquire(self, path):
+        self.scratch.acquire(path)
+
+    def release(self, path):
+        '''
+        releases a memmap allocated from scratch; in-memory arrays are freed with their last reference
+        '''
+        self.scratch.release(path)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.metrics)
+        stats.update(self.scratch.stats())
+        return stats
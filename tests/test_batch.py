@@ -0,0 +1,24 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from preprocessing.classes import batch
+
+
+def crashing_worker(filepath, out_dir, kwargs):
+    # stands in for cut_study_worker; the 'crash' study kills its worker process
+    if 'crash' in filepath:
+        os._exit(1)
+    time.sleep(0.5)  # still running, or queued, when the other worker dies
+    return [os.path.basename(filepath)], None
+
+
+def test_dead_worker_fails_only_its_study(monkeypatch, tmp_path):
+    monkeypatch.setattr(batch, 'cut_study_worker', crashing_worker)
+    studies = [{'file' : name} for name in ('a.img', 'crash.img', 'b.img')]
+    results = batch.run_batch(studies, str(tmp_path), workers=2)
+    assert results['a.img'] == ['a.img']
+    assert results['b.img'] == ['b.img']
+    assert isinstance(results['crash.img'], RuntimeError)
+    assert 'died' in str(results['crash.img'])
@@ -0,0 +1,85 @@
+'''
+Micro-benchmark for PETImage.load_header on synthetic dynamic PET headers.
+Compares against the old per-keyword rescan (kept here only for reference).
+usage: python utils/bench_load_header.py [nframes ...]
+'''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from preprocessing.classes.baseimage import PETImage
+
+def write_header(path, nframes):
+	lines = ['# synthetic header',
+			'axial_blocks 4',
+			'axial_crystals_per_block 12',
+			'axial_crystal_pitch 0.2',
+			'data_type 2',
+			'z_dimension 95',
+			'x_dimension 128',
+			'y_dimension 128',
+			'pixel_size 0.4',
+			'total_frames {}'.format(nframes),
+			'calibration_factor 2.5',
+			'isotope_branching_fraction 0.9']
+	for f in range(nframes):
+		lines += ['frame {}'.format(f),
+				'  scale_factor {}'.format(1e-5*(f+1)),
+				'  frame_duration {}'.format(60),
+				'  frame_start {}'.format(60*f)]
+	with open(path, 'w') as hf:
+		hf.write('\n'.join(lines))
+
+
+def legacy_load_header(img):
+	hdr_lines = open(img.header_file, 'r').read().split('\n')
+	params = {kw : None for kw in img.keywords}
+	for kw in img.keywords:
+		for line in hdr_lines:
+			kv = params[kw]
+			try:
+				if kw == line.strip()[0:len(kw)]:
+					if kw in img.per_frame:
+						if kv is None:
+							params[kw] = np.array([])
+						params[kw] = np.append(params[kw], float(line.strip().split(' ')[1]))
+					elif kv is None:
+						ks = line.strip().split(' ')[1]
+						params[kw] = int(ks) if kw in img.integers else float(ks)
+			except IndexError:
+				pass
+	return params
+
+
+def best_of(fn, repeat=5):
+	times = []
+	for _ in range(repeat):
+		t0 = time.perf_counter()
+		fn()
+		times.append(time.perf_counter()-t0)
+	return min(times)
+
+
+if __name__ == '__main__':
+	counts = [int(n) for n in sys.argv[1:]] or [100, 1000, 5000]
+	tdir = tempfile.mkdtemp()
+	try:
+		for nframes in counts:
+			fpath = os.path.join(tdir, 'bench_pet_{}.pet.img'.format(nframes))
+			write_header(fpath+'.hdr', nframes)
+			img = PETImage(fpath)
+			legacy = legacy_load_header(img)
+			for kw in img.keywords:
+				if not np.array_equal(legacy[kw], getattr(img.params, kw)):
+					raise ValueError('Parsed {} differs from legacy parser'.format(kw))
+			t_new = best_of(img.load_header)
+			t_old = best_of(lambda: legacy_load_header(img), repeat=1)
+			print('{0:>6} frames: load_header {1:8.2f} ms | legacy {2:9.2f} ms | {3:6.1f}x'.format(
+				nframes, t_new*1000, t_old*1000, t_old/t_new))
+	finally:
+		shutil.rmtree(tdir)
@@ -1,25 +1,17 @@
-import os
-import shutil
-import tempfile
-
-tempfolder = tempfile.gettempdir()
-
-print(len(os.listdir(tempfolder)))
-for item in os.listdir(tempfolder):
-	ipath = os.path.join(tempfolder,item)
-	if os.path.isdir(ipath):
-		contents = os.listdir(ipath)
-		if item.startswith('tmp'):
-			try:
-				if all([(fname.startswith('mpet') and fname.endswith('.dat')) for fname in contents]):
-					print('Removing tempdir: {}'.format(item))
-					shutil.rmtree(ipath)
-				elif all([(fname=='preproc_imgtemp.dat' or fname=='imfile.dat') for fname in contents]):
-					print('Removing tempdir: {}'.format(item))
-					shutil.rmtree(ipath)
-			except Exception as e:
-				print('Falied to remove tempdir in clean_tempdir: {}'.format(item))
-				print('Exception: {}'.format(e))
+'''
+Removes scratch sessions left behind by runs that exited without cleaning up (see
+ScratchManager.sweep); sessions of running processes are kept.
+usage: python utils/clean_tempdir.py [scratch root]
+'''
 
+import os
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from preprocessing.classes.scratch import ScratchManager
 
+if __name__ == '__main__':
+	scratch = ScratchManager(root=sys.argv[1] if len(sys.argv) > 1 else None)
+	stats = scratch.stats()
+	scratch.close()
+	print('Removed {0} scratch session(s), {1:.1f} MB.'.format(stats['swept_sessions'], stats['swept_bytes']/10**6))